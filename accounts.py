@@ -0,0 +1,203 @@
+import multiprocessing
+import queue
+import threading
+import time
+from api import TradingAPI
+from candles import BAR_SECONDS
+from collector import MarketCollector
+from journal import TradeJournal
+from main import TradingBot
+from prompts import PromptBuilder
+from quotes import QuoteSnapshot
+from store import StoreBars
+import screener
+from config import (ACCOUNTS, CANDLE_CAPACITY, FEED_QUOTES_INTERVAL, FEED_CANDLES_INTERVAL,
+                    WORKER_RESTART_DELAY, REQUEST_TIMEOUT, METRICS_PORT, STORE_DIR)
+
+# Символ, который аккаунт держит вне общего скрининга, грузится, пока о нем спрашивают
+DEMAND_TTL = 120
+# Недочитанные снимки котировок в очереди аккаунта; старые ему все равно не нужны
+FEED_QUEUE_SIZE = 10
+
+
+class SharedMarketAPI(TradingAPI):
+    """API аккаунта: сессия и сделки - своим ключом, котировки и свечи - из общего потока супервизора"""
+
+    def __init__(self, name, api_key, feed, wants):
+        super().__init__(api_key)
+        self.name = name
+        self.feed = feed
+        self.wants = wants
+        self.feed_symbols = set()
+
+    def get_quotes(self, max_age=None):
+        """Последний опубликованный снимок; старые из очереди пропускаются.
+
+        Если снимок старше max_age, ждем следующий из потока, а отставший поток обходим прямым запросом.
+        """
+        message = None
+        try:
+            while True:
+                message = self.feed.get_nowait()
+        except queue.Empty:
+            pass
+        if message is None and self._quotes is None:
+            message = self.feed.get(timeout=REQUEST_TIMEOUT)
+        if message is not None:
+            self.receive(message)
+        if max_age is not None and self._quotes.is_stale(max_age):
+            try:
+                self.receive(self.feed.get(timeout=FEED_QUOTES_INTERVAL))
+            except queue.Empty:
+                pass
+            if self._quotes.is_stale(max_age):
+                print(f"⚠️  Поток котировок отстал на {self._quotes.age():.1f}с, загружаю сам")
+                self._quotes = QuoteSnapshot(super().get_instruments())
+        return self._quotes
+
+    def receive(self, message):
+        fetched_at, instruments, symbols = message
+        self._quotes = QuoteSnapshot(instruments, fetched_at)
+        self.feed_symbols = set(symbols)
+
+    def get_instruments(self):
+        return self.get_quotes().instruments
+
+    def get_candles(self, symbol):
+        """Свечи из общего хранилища (memmap); чего там нет - заказываем у супервизора и грузим сами"""
+        if symbol not in self.feed_symbols:
+            self.wants.put((self.name, symbol))
+        records = self.store.candles(symbol, last=CANDLE_CAPACITY)
+        # По закрытому рынку новых баров не будет - хватает того, что есть в хранилище
+        inst = self._quotes.get(symbol) if self._quotes is not None else None
+        is_open = bool(inst.get('is_trading_open', True)) if inst else True
+        if len(records) and (not is_open or
+                             time.time() - records['t'][-1] <= 2 * BAR_SECONDS + FEED_CANDLES_INTERVAL):
+            return StoreBars(records)
+        history = self.get_price_history(symbol, CANDLE_CAPACITY)
+        return history.get('history') if history else None
+
+
+def run_worker(index, account, feed, wants):
+    """Процесс одного аккаунта"""
+    name = account['name']
+    api = SharedMarketAPI(name, account['api_key'], feed, wants)
+    bot = TradingBot(
+        api=api,
+        journal=TradeJournal(f"trades_{name}.db"),
+        wallet=account['wallet'],
+        metrics_port=METRICS_PORT + index + 1 if METRICS_PORT else None,
+        metrics_log=f"metrics_{name}.jsonl",
+    )
+    if account.get('prompt'):
+        bot.prompts = PromptBuilder(account['prompt'])
+    bot.run()
+
+
+class Supervisor:
+    """Запускает аккаунты в отдельных процессах и один раз на всех грузит рыночные данные"""
+
+    def __init__(self, accounts=ACCOUNTS):
+        if not STORE_DIR:
+            raise ValueError("для общих свечей нужен STORE_DIR")
+        self.accounts = accounts
+        # Публичные данные тянем ключом первого аккаунта
+        self.api = TradingAPI(accounts[0]['api_key'])
+        self.collector = MarketCollector()
+        self.context = multiprocessing.get_context('spawn')
+        self.wants = self.context.Queue()
+        self.feeds = {}
+        self.workers = {}
+        self.died_at = {}
+        self.demand = {}
+        self.candle_symbols = []
+        self.stop_event = threading.Event()
+
+    def start_worker(self, index, account):
+        name = account['name']
+        self.feeds[name] = self.context.Queue(maxsize=FEED_QUEUE_SIZE)
+        process = self.context.Process(target=run_worker, name=f"account-{name}",
+                                       args=(index, account, self.feeds[name], self.wants), daemon=True)
+        process.start()
+        self.workers[name] = process
+        print(f"🧑‍💼 Аккаунт {name} запущен (pid {process.pid})")
+
+    def collect_demand(self):
+        now = time.time()
+        try:
+            while True:
+                _, symbol = self.wants.get_nowait()
+                self.demand[symbol] = now
+        except queue.Empty:
+            pass
+        self.demand = {s: t for s, t in self.demand.items() if now - t <= DEMAND_TTL}
+
+    def publish(self, snapshot):
+        message = (snapshot.fetched_at, snapshot.instruments, self.candle_symbols)
+        for name, feed in self.feeds.items():
+            try:
+                feed.put_nowait(message)
+            except queue.Full:
+                pass  # аккаунт занят или завис - заберет свежий снимок позже
+
+    def refresh_candles(self):
+        """Свечи кандидатов скрининга и символов, которые держат аккаунты, - в общее хранилище"""
+        self.collect_demand()
+        snapshot = self.api.get_quotes(max_age=FEED_QUOTES_INTERVAL)
+        symbols = screener.prefilter(snapshot.instruments, keep=self.demand)
+        result = self.collector.collect({s: (self.api.get_candles, (s,)) for s in symbols})
+        self.candle_symbols = [s for s in symbols if s not in result.stale]
+
+    def candles_loop(self):
+        while not self.stop_event.is_set():
+            self.stop_event.wait(FEED_CANDLES_INTERVAL)
+            try:
+                self.refresh_candles()
+            except Exception as e:
+                print(f"❌ Ошибка загрузки свечей: {e}")
+
+    def check_workers(self):
+        """Перезапуск упавших аккаунтов с паузой"""
+        now = time.time()
+        for index, account in enumerate(self.accounts):
+            name = account['name']
+            process = self.workers.get(name)
+            if process is None or process.is_alive():
+                continue
+            if name not in self.died_at:
+                print(f"💥 Аккаунт {name} завершился с кодом {process.exitcode}")
+                self.died_at[name] = now
+            elif now - self.died_at[name] >= WORKER_RESTART_DELAY:
+                del self.died_at[name]
+                self.start_worker(index, account)
+
+    def run(self):
+        print(f"🚀 Супервизор: аккаунтов {len(self.accounts)}")
+        # Свечи - до старта аккаунтов, чтобы первый цикл каждого не грузил историю сам
+        self.refresh_candles()
+        for index, account in enumerate(self.accounts):
+            self.start_worker(index, account)
+        threading.Thread(target=self.candles_loop, name="feed-candles", daemon=True).start()
+
+        try:
+            while True:
+                started = time.time()
+                try:
+                    self.publish(self.api.get_quotes(max_age=0))
+                except Exception as e:
+                    print(f"❌ Ошибка загрузки котировок: {e}")
+                self.check_workers()
+                time.sleep(max(0.0, FEED_QUOTES_INTERVAL - (time.time() - started)))
+        except KeyboardInterrupt:
+            print("\n🛑 Остановка аккаунтов...")
+        finally:
+            self.stop_event.set()
+            for process in self.workers.values():
+                process.terminate()
+            for process in self.workers.values():
+                process.join(timeout=5)
+            self.collector.shutdown()
+
+
+if __name__ == "__main__":
+    Supervisor().run()
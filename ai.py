@@ -1,73 +1,282 @@
 from openai import OpenAI
-import re
-from config import AI_API_KEY, AI_BASE_URL, AI_MODEL
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import metrics
+from commands import CommandParser, parse
+from config import (AI_PROVIDERS, AI_STREAM, AI_DEADLINE, AI_TOKEN_BUDGET, AI_CHARS_PER_TOKEN,
+                    AI_HEDGE_MIN_DELAY, AI_BREAKER_FAILURES, AI_BREAKER_COOLDOWN)
+
+class Provider:
+    """OpenAI-совместимый эндпоинт ИИ со статистикой задержек и автоматом отключения"""
+
+    def __init__(self, name, base_url, api_key, model):
+        self.name = name
+        self.model = model
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.latencies = deque(maxlen=100)
+        self.calls = 0
+        self.errors = 0
+        self.failures_in_row = 0
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def p95(self):
+        """95-й перцентиль времени ответа или None, пока нет статистики"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def available(self):
+        """Автомат выключен или истек его таймаут (тогда пробный запрос)"""
+        return time.time() >= self.open_until
+
+    def record_success(self, latency):
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(latency)
+            self.failures_in_row = 0
+            self.open_until = 0
+        self.publish()
+
+    def record_cancelled(self, latency):
+        """Проигравший хедж отменен: его время - нижняя граница, иначе медленный провайдер не виден в p95"""
+        with self.lock:
+            self.latencies.append(latency)
+        self.publish()
+
+    def record_failure(self):
+        with self.lock:
+            self.calls += 1
+            self.errors += 1
+            self.failures_in_row += 1
+            if self.failures_in_row >= AI_BREAKER_FAILURES:
+                self.open_until = time.time() + AI_BREAKER_COOLDOWN
+                print(f"🔌 Провайдер {self.name} отключен на {AI_BREAKER_COOLDOWN}с")
+        self.publish()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'error_rate': self.errors / self.calls if self.calls else 0.0,
+            'p95': self.p95(),
+            'breaker_open': not self.available(),
+        }
+
+    def publish(self):
+        """Статистика провайдера - в gauges метрик"""
+        stats = self.stats()
+        metrics.set_gauge('ai_provider_error_rate', stats['error_rate'], provider=self.name)
+        metrics.set_gauge('ai_provider_breaker_open', int(stats['breaker_open']), provider=self.name)
+        if stats['p95'] is not None:
+            metrics.set_gauge('ai_provider_p95_seconds', stats['p95'], provider=self.name)
+
 
 class AITrader:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=AI_API_KEY,
-            base_url=AI_BASE_URL,
-        )
-        self.model = AI_MODEL
+    def __init__(self, providers=AI_PROVIDERS):
+        self.providers = [Provider(**p) for p in providers]
+        # Основной провайдер - для совместимости с кодом, работающим с одним клиентом
+        self.client = self.providers[0].client
+        self.model = self.providers[0].model
+        self.stream = AI_STREAM
+        self.deadline = AI_DEADLINE
+        self.token_budget = AI_TOKEN_BUDGET
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.providers)), thread_name_prefix="llm")
     
     def call_ai(self, messages):
-        """Вызов API ИИ через aitunnel"""
+        """Вызов ИИ: хеджированные запросы к провайдерам, побеждает первый валидный ответ"""
+        # Автомат мог закрыться по таймауту без единого запроса - обновляем состояние в метриках
+        for provider in self.providers:
+            provider.publish()
+        # Сначала рабочие провайдеры, среди них - самые быстрые по p95
+        candidates = sorted(
+            (p for p in self.providers if p.available()),
+            key=lambda p: p.p95() if p.p95() is not None else float('inf')
+        ) or list(self.providers)
+        
+        if len(candidates) == 1:
+            try:
+                text = self.request(candidates[0], messages)
+            except Exception as e:
+                return f"Ошибка AI: {str(e)}"
+            return text if self.is_complete(text) else self.incomplete(candidates[0], text)
+        
+        cancel = threading.Event()
+        # Без потока проигравший не прервать: он досчитывает в пуле этого вызова, не занимая общий
+        pool = self.pool if self.stream else ThreadPoolExecutor(max_workers=len(candidates),
+                                                                thread_name_prefix="llm")
+        pending = {}
+        fallback = None
+        started = time.time()
+        try:
+            while True:
+                # Следующий запрос стартует, если текущие не ответили за p95 лидера
+                if candidates and (not pending or time.time() - started >= self.hedge_delay(pending)):
+                    provider = candidates.pop(0)
+                    pending[pool.submit(self.request, provider, messages, cancel)] = provider
+                    started = time.time()
+                    if len(pending) > 1:
+                        print(f"🏁 Хедж-запрос к {provider.name}")
+                
+                timeout = None if not candidates else max(0.0, self.hedge_delay(pending) - (time.time() - started))
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending_provider = pending.pop(future)
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        fallback = fallback or f"Ошибка AI: {str(e)}"
+                        continue
+                    if self.is_complete(text):
+                        return text
+                    fallback = fallback or self.incomplete(pending_provider, text)
+                
+                if not pending and not candidates:
+                    return fallback or "Ошибка AI: нет доступных провайдеров"
+        finally:
+            # Проигравшие потоки закрываются по флагу, неначатые снимаются
+            cancel.set()
+            for future in pending:
+                future.cancel()
+            if pool is not self.pool:
+                pool.shutdown(wait=False)
+    
+    @staticmethod
+    def incomplete(provider, text):
+        """Оборванный ответ (дедлайн, бюджет, обрыв потока) - ошибка: не исполняется, не кэшируется"""
+        return f"Ошибка AI: неполный ответ от {provider.name}: {text[-200:]!r}"
+    
+    def hedge_delay(self, pending):
+        """Задержка перед хедж-запросом: p95 самого быстрого из запущенных"""
+        delays = [p.p95() for p in pending.values() if p.p95() is not None]
+        return max(AI_HEDGE_MIN_DELAY, min(delays)) if delays else AI_HEDGE_MIN_DELAY
+    
+    def request(self, provider, messages, cancel=None):
+        """Запрос к одному провайдеру с учетом статистики; исключение при ошибке"""
+        started = time.time()
+        try:
+            if self.stream:
+                text = self.call_ai_stream(messages, provider, cancel)
+            else:
+                response = provider.client.chat.completions.create(
+                    messages=messages,
+                    model=provider.model,
+                    max_tokens=50000,
+                    timeout=self.deadline,
+                )
+                text = response.choices[0].message.content
+                usage = getattr(response, 'usage', None)
+                if usage is not None:
+                    metrics.inc('ai_tokens_total', usage.completion_tokens or 0,
+                                provider=provider.name, kind="completion")
+        except Exception:
+            if cancel and cancel.is_set():
+                metrics.observe('ai_request_seconds', time.time() - started,
+                                provider=provider.name, outcome="cancelled")
+                provider.record_cancelled(time.time() - started)
+            else:
+                provider.record_failure()
+                metrics.observe('ai_request_seconds', time.time() - started,
+                                provider=provider.name, outcome="error")
+            raise
+        outcome = "cancelled" if cancel and cancel.is_set() else "ok"
+        metrics.observe('ai_request_seconds', time.time() - started, provider=provider.name, outcome=outcome)
+        if outcome == "ok":
+            provider.record_success(time.time() - started)
+        else:
+            provider.record_cancelled(time.time() - started)
+        return text
+    
+    def call_ai_stream(self, messages, provider=None, cancel=None):
+        """Потоковый вызов: обрываем, как только пришла полная команда, по дедлайну или бюджету токенов"""
+        provider = provider or self.providers[0]
+        started = time.time()
+        text = ""
+        # Символы рассуждений и ответа; токены по ним оцениваются, пока нет usage от провайдера
+        chars = {'reasoning': 0, 'content': 0}
+        usage = None
+        first_token = None
+        stream = None
+        watchdog = None
+        # Разбор по мере прихода кусков, без повторного чтения всего текста
+        parser = CommandParser()
         try:
-            response = self.client.chat.completions.create(
+            stream = provider.client.chat.completions.create(
                 messages=messages,
-                model=self.model,
+                model=provider.model,
                 max_tokens=50000,
+                stream=True,
+                timeout=self.deadline,
             )
-            return response.choices[0].message.content
+            # Жесткий дедлайн: зависший поток закрываем из таймера, не дожидаясь следующего куска
+            watchdog = threading.Timer(max(0.0, self.deadline - (time.time() - started)), stream.close)
+            watchdog.daemon = True
+            watchdog.start()
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    break
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # Рассуждения reasoning-модели тоже тратят бюджет, но в ответ не идут
+                reasoning = getattr(delta, 'reasoning_content', None)
+                if reasoning or delta.content:
+                    chars['reasoning'] += len(reasoning or "")
+                    chars['content'] += len(delta.content or "")
+                    if first_token is None:
+                        first_token = time.time() - started
+                        metrics.observe('ai_ttft_seconds', first_token, provider=provider.name)
+                if delta.content:
+                    text += delta.content
+                    if parser.feed(delta.content).is_complete():
+                        print(f"⚡ Команда от {provider.name} за {time.time() - started:.1f}с, поток прерван")
+                        break
+                if time.time() - started > self.deadline:
+                    break
+                tokens = (usage.completion_tokens if usage is not None and usage.completion_tokens
+                          else sum(chars.values()) // AI_CHARS_PER_TOKEN)
+                if tokens >= self.token_budget:
+                    print(f"⏱  Бюджет {self.token_budget} токенов исчерпан")
+                    break
+            return text
             
-        except Exception as e:
-            return f"Ошибка AI: {str(e)}"
+        except Exception:
+            # Оборванный поток с частью ответа все еще годится для разбора
+            if text:
+                return text
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            if time.time() - started > self.deadline:
+                print(f"⏱  Дедлайн ИИ {self.deadline}с, ответ оборван")
+            if stream is not None:
+                stream.close()
+            for kind, count in chars.items():
+                metrics.inc('ai_tokens_total', count // AI_CHARS_PER_TOKEN, provider=provider.name, kind=kind)
+    
+    def expected_latency(self):
+        """Ожидаемое время ответа: p95 самого быстрого рабочего провайдера или None без статистики"""
+        latencies = [p.p95() for p in self.providers if p.available() and p.p95() is not None]
+        return min(latencies) if latencies else None
+    
+    def provider_stats(self):
+        return {p.name: p.stats() for p in self.providers}
+    
+    def is_complete(self, response):
+        """В тексте уже есть все объявленные действия с полным набором тегов"""
+        return CommandParser().feed(response).is_complete()
     
     def parse_ai_response(self, response):
-        """Парсинг ответа ИИ на команды"""
-        commands = {
-            'action': None,
-            'instrument': None,
-            'direction': None,
-            'amount': None,
-            'leverage': None,
-            'close_trade': None,
-            'comment': None
-        }
-        
-        # Парсим действия
-        action_match = re.search(r'<действие=([^>]+)>', response)
-        if action_match:
-            commands['action'] = action_match.group(1)
-        
-        # Парсим инструмент
-        instrument_match = re.search(r'<instrument=([^>]+)>', response)
-        if instrument_match:
-            commands['instrument'] = instrument_match.group(1)
-        
-        # Парсим направление
-        direction_match = re.search(r'<direction=([^>]+)>', response)
-        if direction_match:
-            commands['direction'] = direction_match.group(1)
-        
-        # Парсим сумму
-        amount_match = re.search(r'<amount=([^>]+)>', response)
-        if amount_match:
-            commands['amount'] = amount_match.group(1)
-        
-        # Парсим плечо
-        leverage_match = re.search(r'<leverage=([^>]+)>', response)
-        if leverage_match:
-            commands['leverage'] = leverage_match.group(1)
-        
-        # Парсим закрытие сделки
-        close_match = re.search(r'<close_trade=([^>]+)>', response)
-        if close_match:
-            commands['close_trade'] = close_match.group(1)
-        
-        # Парсим комментарий
-        comment_match = re.search(r'<comment>([^<]+)</comment>', response)
-        if comment_match:
-            commands['comment'] = comment_match.group(1).strip()
-        
-        return commands
+        """Парсинг ответа ИИ на типизированные команды (см. commands.py).
+
+        Ответ может содержать несколько блоков <действие=...>; каждый блок - одно действие
+        со своими тегами, <close_trade> принимает список id через запятую.
+        Поля первого действия дублируются на верхнем уровне, 'orders' - все ордера по одному.
+        """
+        return parse(response)
@@ -1,13 +1,33 @@
-import requests
 import json
-import time
-from config import TRADING_API_KEY, REQUEST_TIMEOUT, TRADING_BASE_URL
+from config import TRADING_API_KEY, REQUEST_TIMEOUT, TRADING_BASE_URL, QUOTES_TTL, STORE_DIR
+from quotes import QuoteSnapshot
+from transport import Transport
+from candles import CandleCache
+from store import MarketStore, QuoteWriter
+from metrics import metrics
+
+
+def calc_trade_profit(trade, current_price):
+    """PnL сделки при заданной текущей цене (с учетом плеча и комиссии)"""
+    open_price = float(trade['open_rate'])
+    amount = float(trade['amount'])
+    leverage = int(trade['leverage'])
+    
+    if trade['direction'] == 'buy':
+        profit = (current_price - open_price) / open_price * amount * leverage
+    else:
+        profit = (open_price - current_price) / open_price * amount * leverage
+    
+    # Учитываем комиссии
+    commission = float(trade.get('commission', 0))
+    return profit + commission
+
 
 class TradingAPI:
-    def __init__(self):
-        self.base_url = TRADING_BASE_URL  # Используем правильный URL
+    def __init__(self, api_key=TRADING_API_KEY, base_url=TRADING_BASE_URL, store_dir=STORE_DIR):
+        self.base_url = base_url  # Используем правильный URL (или локальный mockserver.py)
         self.headers = {
-            "Authorization": f"Bearer {TRADING_API_KEY}",
+            "Authorization": f"Bearer {api_key}",
             "accept": "application/json, text/plain, */*",
             "accept-language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
             "content-type": "application/json",
@@ -18,59 +38,86 @@ class TradingAPI:
             "sec-fetch-mode": "cors",
             "sec-fetch-site": "same-site"
         }
+        # Одна пуловая keep-alive сессия на все эндпоинты, заголовки задаются один раз
+        self.http = Transport(self.headers)
+        self._quotes = None
+        # Свечи и котировки сохраняются на диск для индикаторов, перезапусков и офлайн-анализа
+        self.store = MarketStore(store_dir) if store_dir else None
+        self.quote_writer = QuoteWriter(self.store) if self.store is not None else None
+        self.candles = CandleCache(store=self.store)
     
     def get_session(self):
         """Получить данные сессии и баланс"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/users/session",
-                headers=self.headers,
+                endpoint="session",
                 timeout=REQUEST_TIMEOUT
             )
             return response.json() if response.status_code == 200 else None
         except Exception as e:
+            metrics.inc('api_errors_total', method="get_session")
             print(f"Ошибка получения сессии: {e}")
             return None
     
     def get_instruments(self):
         """Получить список инструментов"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/instruments",
-                headers=self.headers,
+                endpoint="instruments",
                 timeout=REQUEST_TIMEOUT
             )
             if response.status_code == 200:
                 data = response.json()
-                return data.get('instruments', [])[:10]
+                return data.get('instruments', [])
             return []
         except Exception as e:
+            metrics.inc('api_errors_total', method="get_instruments")
             print(f"Ошибка получения инструментов: {e}")
             return []
     
+    def get_quotes(self, max_age=QUOTES_TTL):
+        """Снимок котировок на цикл: повторно используется, пока не устарел"""
+        if self._quotes is None or self._quotes.is_stale(max_age):
+            self._quotes = QuoteSnapshot(self.get_instruments())
+            if self.quote_writer is not None:
+                # Запись на диск - в фоне, снимок нужен циклу сейчас
+                self.quote_writer.put(self._quotes)
+        return self._quotes
+    
     def get_price_history(self, symbol, count=30):
         """Получить историю цен"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/instruments/history/{symbol}/m1?count={count}",
-                headers=self.headers,
+                endpoint="history",
                 timeout=REQUEST_TIMEOUT
             )
             return response.json() if response.status_code == 200 else None
         except Exception as e:
+            metrics.inc('api_errors_total', method="get_price_history")
             print(f"Ошибка получения истории {symbol}: {e}")
             return None
     
+    def get_candles(self, symbol):
+        """История m1-свечей из кэша: с сервера догружаются только новые бары"""
+        # По закрытому рынку сервер не дергаем, если история уже есть
+        inst = self._quotes.get(symbol) if self._quotes is not None else None
+        is_open = bool(inst.get('is_trading_open', True)) if inst else True
+        return self.candles.get(self, symbol, is_open=is_open)
+    
     def get_closed_trades(self, wallet, from_time, to_time):
         """Получить закрытые сделки с реальным PnL"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/trades/closed/{wallet}?from={from_time}&to={to_time}",
-                headers=self.headers,
+                endpoint="closed_trades",
                 timeout=REQUEST_TIMEOUT
             )
             return response.json() if response.status_code == 200 else None
         except Exception as e:
+            metrics.inc('api_errors_total', method="get_closed_trades")
             print(f"Ошибка получения закрытых сделок: {e}")
             return None
     
@@ -78,102 +125,81 @@ class TradingAPI:
         """Получить активные сделки"""
         try:
             # Попробуем разные эндпоинты для активных сделок
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/trades/active",
-                headers=self.headers,
+                endpoint="active_trades",
                 timeout=REQUEST_TIMEOUT
             )
             if response.status_code == 200:
                 return response.json()
             
             # Если не работает, попробуем другой эндпоинт
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/trades",
-                headers=self.headers,
+                endpoint="trades",
                 timeout=REQUEST_TIMEOUT
             )
             return response.json() if response.status_code == 200 else {"trades": []}
             
         except Exception as e:
+            metrics.inc('api_errors_total', method="get_active_trades")
             print(f"Ошибка получения активных сделок: {e}")
             return {"trades": []}
     
     def get_trade_status(self, trade_id):
         """Получить статус конкретной сделки"""
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/trades/{trade_id}",
-                headers=self.headers,
+                endpoint="trade_status",
                 timeout=REQUEST_TIMEOUT
             )
             return response.json() if response.status_code == 200 else None
         except Exception as e:
+            metrics.inc('api_errors_total', method="get_trade_status")
             print(f"Ошибка получения статуса сделки {trade_id}: {e}")
             return None
     
-    def get_all_trades_with_profit(self, wallet="DOLLR"):
-        """Получить все сделки с реальным PnL"""
-        try:
-            # Получаем закрытые сделки за последний период
-            from_time = 0
-            to_time = int(time.time() * 1000)  # Текущее время в мс
-            
-            closed_trades = self.get_closed_trades(wallet, from_time, to_time)
+    def get_active_trades_with_profit(self, quotes=None, active_trades=None):
+        """Получить активные сделки с текущим PnL; active_trades - уже полученный ответ /trades/active"""
+        if active_trades is None:
             active_trades = self.get_active_trades()
-            
-            # Объединяем все сделки
-            all_trades = []
-            
-            # Добавляем активные сделки
-            if active_trades and 'trades' in active_trades:
-                for trade in active_trades['trades']:
-                    trade['status'] = 'active'
-                    trade['current_profit'] = self.calculate_current_profit(trade)
-                    all_trades.append(trade)
-            
-            # Добавляем закрытые сделки
-            if closed_trades and 'trades' in closed_trades:
-                for trade in closed_trades['trades']:
-                    trade['status'] = 'closed'
-                    trade['current_profit'] = trade.get('profit', 0)
-                    all_trades.append(trade)
-            
-            return all_trades
-            
-        except Exception as e:
-            print(f"Ошибка получения всех сделок: {e}")
+        if not active_trades or 'trades' not in active_trades:
             return []
+        
+        # PnL считаем пачкой по одному снимку котировок
+        profits = self.calculate_profits(active_trades['trades'], quotes)
+        for trade in active_trades['trades']:
+            trade['status'] = 'active'
+            trade['current_profit'] = profits.get(trade['id'], 0)
+        return active_trades['trades']
+    
+    def calculate_profits(self, trades, quotes=None):
+        """Рассчитать PnL для списка активных сделок по одному снимку котировок"""
+        if quotes is None:
+            quotes = self.get_quotes()
+        return {trade['id']: self.calculate_current_profit(trade, quotes) for trade in trades}
     
-    def calculate_current_profit(self, trade):
+    def calculate_current_profit(self, trade, quotes=None):
         """Рассчитать текущий PnL для активной сделки"""
         try:
-            # Получаем текущую цену инструмента
-            instruments = self.get_instruments()
-            current_instrument = next((inst for inst in instruments if inst['symbol'] == trade['instrument']), None)
+            # Берем текущую цену из снимка котировок, а не отдельным запросом
+            if quotes is None:
+                quotes = self.get_quotes()
+            current_price = quotes.rate(trade['instrument'])
             
-            if not current_instrument:
+            if current_price is None:
                 return 0
             
-            current_price = float(current_instrument.get('rate', 0))
-            open_price = float(trade['open_rate'])
-            amount = float(trade['amount'])
-            leverage = int(trade['leverage'])
-            
-            if trade['direction'] == 'buy':
-                profit = (current_price - open_price) / open_price * amount * leverage
-            else:
-                profit = (open_price - current_price) / open_price * amount * leverage
-            
-            # Учитываем комиссии
-            commission = float(trade.get('commission', 0))
-            return profit + commission
+            return calc_trade_profit(trade, current_price)
             
         except Exception as e:
+            metrics.inc('api_errors_total', method="calculate_current_profit")
             print(f"Ошибка расчета PnL: {e}")
             return 0
     
     def open_trade(self, amount, direction, instrument, leverage, wallet, 
-                   take_profit=None, stop_loss=None):
+                   take_profit=None, stop_loss=None, idempotency_key=None):
         """Открыть сделку"""
         try:
             data = {
@@ -186,24 +212,27 @@ class TradingAPI:
                 "stop_loss_price": stop_loss
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/trades",
-                headers=self.headers,
+                endpoint="open_trade",
                 json=data,
+                headers={"Idempotency-Key": idempotency_key} if idempotency_key else None,
                 timeout=REQUEST_TIMEOUT
             )
             return response.json() if response.status_code == 200 else None
         except Exception as e:
+            metrics.inc('api_errors_total', method="open_trade")
             print(f"Ошибка открытия сделки: {e}")
             return None
     
-    def close_trade(self, trade_id):
+    def close_trade(self, trade_id, idempotency_key=None):
         """Закрыть сделку"""
         try:
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/trades/{trade_id}/close",
-                headers=self.headers,
+                endpoint="close_trade",
                 json={},  # Пустое тело как в примере
+                headers={"Idempotency-Key": idempotency_key} if idempotency_key else None,
                 timeout=REQUEST_TIMEOUT
             )
             
@@ -213,5 +242,6 @@ class TradingAPI:
             
             return response.json() if response.status_code == 200 else None
         except Exception as e:
+            metrics.inc('api_errors_total', method="close_trade")
             print(f"❌ Ошибка закрытия сделки: {e}")
             return None
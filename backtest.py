@@ -0,0 +1,377 @@
+import argparse
+import bisect
+import contextlib
+import io
+import json
+import math
+import os
+import threading
+import time
+from ai import AITrader
+from api import TradingAPI, calc_trade_profit
+from candles import BAR_SECONDS, bar_time
+from decisions import DecisionCache
+from journal import TradeJournal
+from main import TradingBot
+from quotes import QuoteSnapshot
+from store import MarketStore
+from config import (DEFAULT_WALLET, UPDATE_INTERVAL, CANDLE_CAPACITY,
+                    BACKTEST_BALANCE, BACKTEST_COMMISSION, RISK_STOP_LOSS, RISK_TAKE_PROFIT)
+
+
+def bisect_times(times, value):
+    """bisect_right и для списков, и для массивов NumPy"""
+    if hasattr(times, 'searchsorted'):
+        return int(times.searchsorted(value, side='right'))
+    return bisect.bisect_right(times, value)
+
+
+class VirtualClock:
+    """Виртуальное время: sleep мгновенно сдвигает часы"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimulatedAPI(TradingAPI):
+    """TradingAPI поверх записанных свечей: котировки и исполнение по виртуальному времени"""
+
+    def __init__(self, recording, clock, balance=BACKTEST_BALANCE, commission=BACKTEST_COMMISSION):
+        self.clock = clock
+        self.wallet_balance = balance
+        self.commission = commission
+        self.instruments = {inst['symbol']: inst for inst in recording['instruments']}
+        self.bars = {s: bars for s, bars in recording['candles'].items() if s in self.instruments}
+        # Колоночные свечи (sweep.BarArray) отдают готовый массив времени без копирования
+        self.times = {
+            s: bars.times if hasattr(bars, 'times') else [bar_time(bar) for bar in bars]
+            for s, bars in self.bars.items()
+        }
+        self.active = {}
+        self.closed = []
+        self.next_id = 1
+        self.checked_to = clock.time()
+        # Ордера пачки приходят из нескольких потоков исполнителя
+        self.lock = threading.RLock()
+        self.idempotent = {}
+
+    def time_range(self):
+        """Интервал времени, покрытый записью"""
+        starts = [t[0] for t in self.times.values() if len(t)]
+        ends = [t[-1] + BAR_SECONDS for t in self.times.values() if len(t)]
+        return min(starts), max(ends)
+
+    def _completed(self, symbol, now=None):
+        """Число баров символа, закрытых к моменту now"""
+        now = self.clock.time() if now is None else now
+        return bisect_times(self.times.get(symbol, []), now - BAR_SECONDS)
+
+    def rate(self, symbol):
+        n = self._completed(symbol)
+        return float(self.bars[symbol][n - 1]['c']) if n else None
+
+    def get_session(self):
+        return {'balance': [{'wallet': DEFAULT_WALLET, 'amount': round(self.wallet_balance, 2)}], 'miner': {}}
+
+    def get_instruments(self):
+        instruments = []
+        for symbol, inst in self.instruments.items():
+            rate = self.rate(symbol)
+            if rate is None:
+                continue
+            instruments.append(dict(inst, rate=rate, ask=rate, bid=rate, is_trading_open=True))
+        return instruments
+
+    def get_quotes(self, max_age=None):
+        # Кэш по реальному времени в симуляции не годится - снимок на каждый вызов
+        return QuoteSnapshot(self.get_instruments())
+
+    def get_price_history(self, symbol, count=30):
+        n = self._completed(symbol)
+        return {'history': self.bars.get(symbol, [])[max(0, n - count):n]}
+
+    def get_candles(self, symbol):
+        return self.get_price_history(symbol, CANDLE_CAPACITY)['history'] or None
+
+    def get_closed_trades(self, wallet, from_time, to_time):
+        return {'trades': [t for t in self.closed if from_time <= t['closed_at'] <= to_time]}
+
+    def get_active_trades(self):
+        return {'trades': [dict(t) for t in self.active.values()]}
+
+    def get_trade_status(self, trade_id):
+        trade = self.active.get(str(trade_id))
+        return {'trade': dict(trade)} if trade else None
+
+    def open_trade(self, amount, direction, instrument, leverage, wallet,
+                   take_profit=None, stop_loss=None, idempotency_key=None):
+        with self.lock:
+            # Как сервер с поддержкой Idempotency-Key: повтор возвращает прежний ответ
+            if idempotency_key in self.idempotent:
+                return self.idempotent[idempotency_key]
+            result = self._open_trade(amount, direction, instrument, leverage, wallet, take_profit, stop_loss)
+            if idempotency_key and result:
+                self.idempotent[idempotency_key] = result
+            return result
+
+    def _open_trade(self, amount, direction, instrument, leverage, wallet, take_profit, stop_loss):
+        rate = self.rate(instrument)
+        if rate is None or amount > self.wallet_balance:
+            return None
+        trade = {
+            'id': str(self.next_id),
+            'instrument': instrument,
+            'direction': direction,
+            'amount': amount,
+            'leverage': leverage,
+            'wallet': wallet,
+            'open_rate': rate,
+            'opened_at': int(self.clock.time() * 1000),
+            # Комиссия со всего объема позиции, учитывается в PnL как в реальном API
+            'commission': -amount * leverage * self.commission,
+            'take_profit_price': take_profit,
+            'stop_loss_price': stop_loss,
+        }
+        self.next_id += 1
+        self.wallet_balance -= amount
+        self.active[trade['id']] = trade
+        return {'trade': dict(trade)}
+
+    def close_trade(self, trade_id, idempotency_key=None, *, price=None):
+        """Закрытие по текущей цене; price - цена сработки SL/TP биржи"""
+        with self.lock:
+            if idempotency_key in self.idempotent:
+                return self.idempotent[idempotency_key]
+            result = self._close_trade(trade_id, price)
+            if idempotency_key and result:
+                self.idempotent[idempotency_key] = result
+            return result
+
+    def _close_trade(self, trade_id, price):
+        trade = self.active.pop(str(trade_id), None)
+        if trade is None:
+            return None
+        price = self.rate(trade['instrument']) if price is None else price
+        profit = calc_trade_profit(trade, price)
+        # Ликвидация: теряем не больше маржи
+        profit = max(profit, -float(trade['amount']))
+        trade.update(close_rate=price, profit=profit, closed_at=int(self.clock.time() * 1000))
+        self.wallet_balance += float(trade['amount']) + profit
+        self.closed.append(trade)
+        return {'trade': dict(trade)}
+
+    def check_orders(self):
+        """Сработка take-profit/stop-loss по high/low баров, прошедших с прошлой проверки"""
+        now = self.clock.time()
+        for trade in list(self.active.values()):
+            symbol = trade['instrument']
+            times = self.times.get(symbol, [])
+            lo = bisect_times(times, self.checked_to - BAR_SECONDS)
+            hi = self._completed(symbol, now)
+            tp, sl = trade.get('take_profit_price'), trade.get('stop_loss_price')
+            for bar in self.bars[symbol][lo:hi]:
+                high, low = float(bar['h']), float(bar['l'])
+                buy = trade['direction'] == 'buy'
+                if sl is not None and (low <= sl if buy else high >= sl):
+                    self.close_trade(trade['id'], price=sl)
+                    break
+                if tp is not None and (high >= tp if buy else low <= tp):
+                    self.close_trade(trade['id'], price=tp)
+                    break
+        self.checked_to = now
+
+    def equity(self):
+        """Баланс плюс маржа и нереализованный PnL открытых позиций"""
+        total = self.wallet_balance
+        for trade in self.active.values():
+            rate = self.rate(trade['instrument'])
+            pnl = calc_trade_profit(trade, rate) if rate is not None else 0
+            total += float(trade['amount']) + max(pnl, -float(trade['amount']))
+        return total
+
+
+class RecordedAI(AITrader):
+    """Проигрывает заранее записанные ответы ИИ по очереди"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.model = "recorded"
+        self.providers = []
+        self.calls = 0
+
+    def call_ai(self, messages):
+        if self.calls >= len(self.responses):
+            return "<действие=wait>\n<comment>Записанные ответы закончились</comment>"
+        response = self.responses[self.calls]
+        self.calls += 1
+        return response
+
+
+class RuleBasedAI(AITrader):
+    """Детерминированная замена ИИ: правила PnL из prompt.txt и вход по тренду"""
+
+    def __init__(self, api, take_profit=20, stop_loss=10, amount=50, leverage=20, lookback=20):
+        self.api = api
+        self.model = "rules"
+        self.providers = []
+        self.take_profit = take_profit
+        self.stop_loss = stop_loss
+        self.amount = amount
+        self.leverage = leverage
+        self.lookback = lookback
+
+    def call_ai(self, messages):
+        for trade in self.api.get_active_trades_with_profit():
+            percent = trade['current_profit'] / float(trade['amount']) * 100
+            if percent >= self.take_profit or percent <= -self.stop_loss:
+                return (f"<действие=close>\n<close_trade={trade['id']}>\n"
+                        f"<comment>PnL {percent:.1f}% достиг порога</comment>")
+
+        if not self.api.active:
+            for symbol in self.api.instruments:
+                bars = self.api.get_price_history(symbol, self.lookback)['history']
+                if len(bars) < self.lookback:
+                    continue
+                first, last = float(bars[0]['c']), float(bars[-1]['c'])
+                if first == last:
+                    continue
+                direction = 'buy' if last > first else 'sell'
+                return (f"<действие=open>\n<instrument={symbol}>\n<direction={direction}>\n"
+                        f"<amount={self.amount}>\n<leverage={self.leverage}>\n"
+                        f"<comment>Вход по тренду {self.lookback} баров</comment>")
+
+        return "<действие=wait>\n<comment>Нет сигнала</comment>"
+
+
+class Backtester:
+    """Прогон TradingBot по записанным данным на виртуальных часах"""
+
+    def __init__(self, recording, ai_factory=None, interval=UPDATE_INTERVAL,
+                 balance=BACKTEST_BALANCE, symbols=None, cache_decisions=False,
+                 stop_loss=RISK_STOP_LOSS, take_profit=RISK_TAKE_PROFIT):
+        if symbols is not None:
+            recording = dict(recording, instruments=[
+                inst for inst in recording['instruments'] if inst['symbol'] in symbols
+            ])
+        self.clock = VirtualClock(0)
+        self.api = SimulatedAPI(recording, self.clock, balance)
+        start, self.end = self.api.time_range()
+        # Первый цикл - после накопления окна истории для индикаторов
+        self.clock.now = self.api.checked_to = start + BAR_SECONDS * 30
+        self.interval = interval
+        self.balance = balance
+        ai = ai_factory(self.api) if ai_factory else RuleBasedAI(self.api)
+        self.bot = TradingBot(api=self.api, ai=ai, journal=TradeJournal(':memory:', clock=self.clock.time),
+                              clock=self.clock)
+        # Пороги риск-монитора задают и его локальные SL/TP, и цены SL/TP на стороне биржи
+        self.bot.risk.stop_loss = stop_loss
+        self.bot.risk.take_profit = take_profit
+        if not cache_decisions:
+            # Заглушки ИИ дешевы и детерминированы - кэш решений только исказит прогон
+            self.bot.decisions = DecisionCache(ttl=0)
+
+    def run(self, quiet=True):
+        """Прогнать запись целиком и вернуть отчет"""
+        equity = []
+        started = time.time()
+        output = io.StringIO() if quiet else None
+        with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+            while self.clock.time() < self.end:
+                try:
+                    self.bot.run_cycle()
+                except Exception as e:
+                    print(f"❌ Ошибка в цикле бэктеста: {e}")
+                equity.append(self.api.equity())
+                self.advance(self.interval)
+        self.bot.collector.shutdown()
+        self.bot.ai_pool.shutdown()
+        self.bot.orders.shutdown()
+        return self.report(equity, time.time() - started)
+
+    def advance(self, seconds):
+        """Сдвинуть часы до следующего цикла: SL/TP биржи и риск-монитор отрабатывают на каждом баре"""
+        target = self.clock.time() + seconds
+        while self.clock.time() < target:
+            self.clock.sleep(min(BAR_SECONDS, target - self.clock.time()))
+            self.api.check_orders()
+            try:
+                self.bot.risk.check()
+            except Exception as e:
+                print(f"❌ Ошибка риск-монитора: {e}")
+
+    def report(self, equity, elapsed):
+        closed = self.api.closed
+        profits = [t['profit'] for t in closed]
+        peak, max_drawdown = -math.inf, 0.0
+        for value in equity:
+            peak = max(peak, value)
+            max_drawdown = max(max_drawdown, (peak - value) / peak * 100 if peak > 0 else 0)
+
+        returns = [b / a - 1 for a, b in zip(equity, equity[1:]) if a > 0]
+        sharpe = 0.0
+        if len(returns) > 1:
+            mean = sum(returns) / len(returns)
+            std = math.sqrt(sum((r - mean) ** 2 for r in returns) / (len(returns) - 1))
+            # Годовая нормировка по числу циклов в году
+            sharpe = mean / std * math.sqrt(365 * 24 * 3600 / self.interval) if std > 0 else 0.0
+
+        return {
+            'pnl': (equity[-1] if equity else self.balance) - self.balance,
+            'final_equity': equity[-1] if equity else self.balance,
+            'max_drawdown': max_drawdown,
+            'trades': len(closed),
+            'profitable': len([p for p in profits if p > 0]),
+            'losing': len([p for p in profits if p < 0]),
+            'sharpe': sharpe,
+            'cycles': len(equity),
+            'elapsed': elapsed,
+        }
+
+
+def load_recording(path):
+    """Запись из JSON-файла или из каталога MarketStore (через memmap, без загрузки в память)"""
+    if os.path.isdir(path):
+        return MarketStore(path).recording()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def record_market_data(path, count=CANDLE_CAPACITY):
+    """Записать инструменты и m1-историю с живого API для последующих прогонов"""
+    api = TradingAPI()
+    instruments = api.get_instruments()
+    candles = {}
+    for inst in instruments:
+        history = api.get_price_history(inst['symbol'], count)
+        if history and 'history' in history:
+            candles[inst['symbol']] = history['history']
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'instruments': instruments, 'candles': candles}, f, ensure_ascii=False)
+    return len(candles)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бэктест AI-трейдера на записанных данных")
+    parser.add_argument("recording", help="JSON с инструментами и свечами или каталог MarketStore")
+    parser.add_argument("--record", action="store_true", help="записать данные с живого API в файл")
+    parser.add_argument("--responses", help="JSON-список записанных ответов ИИ")
+    parser.add_argument("--interval", type=int, default=UPDATE_INTERVAL)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.record:
+        print(f"💾 Записано инструментов: {record_market_data(args.recording)}")
+    else:
+        factory = None
+        if args.responses:
+            responses = load_recording(args.responses)
+            factory = lambda api: RecordedAI(responses)
+        result = Backtester(load_recording(args.recording), factory, args.interval).run(quiet=not args.verbose)
+        for key, value in result.items():
+            print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
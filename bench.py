@@ -0,0 +1,147 @@
+import argparse
+import contextlib
+import io
+import json
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from ai import AITrader
+from api import TradingAPI
+from decisions import DecisionCache
+from journal import TradeJournal
+from main import TradingBot
+from mockserver import MockTradingServer
+from ratelimit import RequestScheduler
+
+SIZES = (10, 100, 1000)
+# Метрики, по которым сравниваем с базовым прогоном: рост больше порога - регрессия
+COMPARED = ('p50', 'p95', 'requests', 'kb_in', 'kb_out', 'mem_peak_kb')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def build_bot(server, store_dir, rate_limits=False):
+    """Бот целиком на локальной заглушке: торговый API, ИИ и журнал в памяти"""
+    api = TradingAPI(api_key="bench", base_url=server.url, store_dir=store_dir)
+    if not rate_limits:
+        # Лимиты платформы маскируют собственные затраты бота - по умолчанию снимаем
+        api.http.scheduler = RequestScheduler(limits={}, global_limit=None)
+    ai = AITrader(providers=[{"name": "mock", "base_url": server.ai_url, "api_key": "bench", "model": "mock"}])
+    bot = TradingBot(api=api, ai=ai, journal=TradeJournal(':memory:'), metrics_port=None)
+    # Каждый цикл должен доходить до ИИ, иначе меряем кэш
+    bot.decisions = DecisionCache(ttl=0)
+    return bot
+
+
+def run_size(size, cycles, warmup, memory_cycles, server_options, rate_limits=False):
+    """Прогон бота на size инструментов и size позиций; сводка по циклам после прогрева"""
+    server = MockTradingServer(instruments=size, positions=size, **server_options).start()
+    try:
+        with tempfile.TemporaryDirectory() as store_dir:
+            bot = build_bot(server, store_dir, rate_limits)
+            latencies, requests, bytes_in, bytes_out = [], [], [], []
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                for i in range(warmup + cycles):
+                    server.reset_stats()
+                    started = time.perf_counter()
+                    bot.run_cycle()
+                    elapsed = time.perf_counter() - started
+                    stats = server.snapshot()
+                    if i < warmup:
+                        continue
+                    latencies.append(elapsed)
+                    requests.append(stats['requests'])
+                    # С точки зрения бота: отправлено - тела запросов, получено - тела ответов
+                    bytes_out.append(stats['bytes_in'])
+                    bytes_in.append(stats['bytes_out'])
+
+                # Память - отдельными циклами: tracemalloc замедляет выполнение и исказил бы задержки
+                peaks = []
+                tracemalloc.start()
+                for _ in range(memory_cycles):
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    bot.run_cycle()
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                tracemalloc.stop()
+            bot.collector.shutdown()
+            bot.ai_pool.shutdown()
+            bot.orders.shutdown()
+    finally:
+        server.stop()
+
+    return {
+        'size': size,
+        'cycles': cycles,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies, default=0.0),
+        'requests': statistics.mean(requests) if requests else 0,
+        'kb_in': statistics.mean(bytes_in) / 1024 if bytes_in else 0,
+        'kb_out': statistics.mean(bytes_out) / 1024 if bytes_out else 0,
+        'mem_peak_kb': statistics.mean(peaks) / 1024 if peaks else 0,
+        'rss_max_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_table(results, baseline=None, threshold=20.0):
+    print(f"{'N':>6} {'p50, с':>8} {'p95, с':>8} {'p99, с':>8} {'запр/цикл':>10} "
+          f"{'KB вход':>9} {'KB выход':>9} {'пик памяти, KB':>15} {'RSS, MB':>8}")
+    regressions = []
+    for r in results:
+        print(f"{r['size']:>6} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f} {r['requests']:>10.1f} "
+              f"{r['kb_in']:>9.1f} {r['kb_out']:>9.1f} {r['mem_peak_kb']:>15.0f} {r['rss_max_mb']:>8.0f}")
+        base = (baseline or {}).get(str(r['size']))
+        if not base:
+            continue
+        for key in COMPARED:
+            if base.get(key) and (r[key] / base[key] - 1) * 100 > threshold:
+                regressions.append(f"N={r['size']} {key}: {base[key]:.3f} -> {r[key]:.3f} "
+                                   f"(+{(r[key] / base[key] - 1) * 100:.0f}%)")
+    for line in regressions:
+        print(f"🐢 Регрессия: {line}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк цикла бота на локальной заглушке API")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="инструментов и позиций")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2, help="циклов прогрева (первая загрузка истории)")
+    parser.add_argument("--memory-cycles", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка API, секунд")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--ai-latency", type=float, default=0.2)
+    parser.add_argument("--rate-limits", action="store_true", help="оставить лимиты запросов из config.py")
+    parser.add_argument("--json", help="сохранить результаты (базовый прогон для сравнения)")
+    parser.add_argument("--baseline", help="сравнить с сохраненным прогоном")
+    parser.add_argument("--threshold", type=float, default=20.0, help="рост в %%, считающийся регрессией")
+    args = parser.parse_args()
+
+    options = {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+               'throttle_rate': args.throttle_rate, 'ai_latency': args.ai_latency}
+    results = []
+    for size in args.sizes:
+        print(f"⏱  N={size}...")
+        results.append(run_size(size, args.cycles, args.warmup, args.memory_cycles, options, args.rate_limits))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    regressions = print_table(results, baseline, args.threshold)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({str(r['size']): r for r in results}, f, ensure_ascii=False, indent=2)
+    raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque
+from config import CANDLE_CAPACITY
+
+BAR_SECONDS = 60  # таймфрейм m1
+
+
+def bar_time(bar):
+    """Время открытия бара в секундах (API может отдавать мс)"""
+    t = float(bar['t'])
+    return t / 1000 if t > 1e12 else t
+
+
+class CandleCache:
+    """Кэш m1-свечей по символам: кольцевой буфер, догрузка только новых баров"""
+
+    def __init__(self, capacity=CANDLE_CAPACITY, store=None):
+        self.capacity = capacity
+        # Постоянное хранилище: после перезапуска догружаются только бары, которых в нем нет
+        self.store = store
+        self.bars = {}
+        # Время последнего ответа сервера по символу: раньше него новых баров уже не будет
+        self.fetched_at = {}
+        self.lock = threading.Lock()
+        self.stats = {'full': 0, 'incremental': 0, 'gaps': 0}
+
+    def missing_count(self, symbol, now=None):
+        """Сколько баров догрузить (с текущим формирующимся); None - нужна полная загрузка"""
+        bars = self.bars.get(symbol)
+        if not bars:
+            return None
+        now = time.time() if now is None else now
+        # Отставание считаем от последней загрузки, а не от последнего бара:
+        # у закрытого рынка бар может быть часовой давности, а догружать нечего
+        since = max(bar_time(bars[-1]), self.fetched_at.get(symbol, 0))
+        behind = int((now - since) // BAR_SECONDS) + 1
+        if behind >= self.capacity:
+            return None
+        # +1 бар перекрытия, чтобы проверить стык с кэшем
+        return max(2, behind + 1)
+
+    def merge(self, symbol, new_bars):
+        """Влить свежие бары; False если между кэшем и ними разрыв"""
+        bars = self.bars.get(symbol)
+        if not bars or not new_bars:
+            return False
+
+        last_time = bar_time(bars[-1])
+        if bar_time(new_bars[0]) > last_time + BAR_SECONDS:
+            return False
+
+        for bar in new_bars:
+            t = bar_time(bar)
+            if t < last_time:
+                continue
+            if t == last_time:
+                # Последний бар мог еще формироваться - заменяем его
+                bars[-1] = bar
+            else:
+                bars.append(bar)
+            last_time = t
+        return True
+
+    def refill(self, symbol, new_bars):
+        self.bars[symbol] = deque(new_bars, maxlen=self.capacity)
+
+    def load(self, symbol):
+        """Поднять окно символа из хранилища при первом обращении"""
+        if self.store is None or symbol in self.bars:
+            return
+        records = self.store.candles(symbol, last=self.capacity)
+        if len(records):
+            with self.lock:
+                self.refill(symbol, [dict(zip(records.dtype.names, row)) for row in records.tolist()])
+
+    def save(self, symbol, new_bars):
+        if self.store is None:
+            return
+        try:
+            self.store.append_candles(symbol, new_bars)
+        except Exception as e:
+            print(f"❌ Ошибка записи свечей {symbol} в хранилище: {e}")
+
+    def get(self, api, symbol, is_open=True):
+        """Актуальная история символа из кэша, с догрузкой новых баров"""
+        self.load(symbol)
+        if not is_open:
+            # Торги закрыты - новых баров нет, хватает кэша
+            with self.lock:
+                bars = list(self.bars.get(symbol, []))
+            if bars:
+                return bars
+        count = self.missing_count(symbol)
+        if count is not None:
+            started = time.time()
+            history = api.get_price_history(symbol, count)
+            if not history or 'history' not in history:
+                return list(self.bars.get(symbol, [])) or None
+            with self.lock:
+                merged = self.merge(symbol, history['history'])
+                if merged:
+                    self.fetched_at[symbol] = started
+                    self.stats['incremental'] += 1
+                    bars = list(self.bars[symbol])
+                else:
+                    self.stats['gaps'] += 1
+            if merged:
+                self.save(symbol, history['history'])
+                return bars
+
+        # Первый запрос, большой простой или разрыв - полная перезагрузка окна
+        started = time.time()
+        history = api.get_price_history(symbol, self.capacity)
+        if not history or 'history' not in history:
+            return list(self.bars.get(symbol, [])) or None
+        with self.lock:
+            self.fetched_at[symbol] = started
+            bars = self.bars.get(symbol)
+            if bars and history['history'] and bar_time(history['history'][-1]) == bar_time(bars[-1]):
+                # Сервер не прислал ничего нового - окно в кэше уже актуально
+                return list(bars)
+            self.refill(symbol, history['history'])
+            self.stats['full'] += 1
+            bars = list(self.bars[symbol])
+        self.save(symbol, history['history'])
+        return bars
@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import FETCH_CONCURRENCY, CYCLE_DEADLINE
+
+
+class CollectResult:
+    """Результаты параллельного сбора: данные, время запросов и опоздавшие задачи"""
+
+    def __init__(self):
+        self.results = {}
+        self.timings = {}
+        self.stale = set()
+        self.errors = {}
+
+    def get(self, name, default=None):
+        return self.results.get(name, default)
+
+    def is_stale(self, name):
+        return name in self.stale
+
+
+class MarketCollector:
+    """Параллельный сбор независимых запросов цикла с ограничением и дедлайном"""
+
+    def __init__(self, max_workers=FETCH_CONCURRENCY, deadline=CYCLE_DEADLINE):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="collector")
+        self.deadline = deadline
+
+    def _timed(self, fn, args):
+        started = time.time()
+        try:
+            return fn(*args), None, time.time() - started
+        except Exception as e:
+            return None, e, time.time() - started
+
+    def collect(self, tasks, deadline=None):
+        """Выполнить задачи {имя: (функция, аргументы)} параллельно до дедлайна"""
+        deadline = self.deadline if deadline is None else deadline
+        result = CollectResult()
+        futures = {
+            self.pool.submit(self._timed, fn, args): name
+            for name, (fn, args) in tasks.items()
+        }
+
+        done, not_done = wait(futures, timeout=max(0, deadline))
+
+        for future in done:
+            name = futures[future]
+            value, error, elapsed = future.result()
+            result.timings[name] = elapsed
+            if error is not None:
+                result.errors[name] = error
+                result.stale.add(name)
+            else:
+                result.results[name] = value
+
+        # Не уложившиеся в дедлайн помечаем устаревшими, их результат игнорируем
+        for future in not_done:
+            future.cancel()
+            name = futures[future]
+            result.stale.add(name)
+            result.timings[name] = deadline
+
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,332 @@
+import argparse
+import math
+import re
+import time
+from config import MIN_TRADE_AMOUNT, MAX_LEVERAGE
+
+# Все теги ответа одним выражением: текст сканируется один раз, без поиска по каждому тегу.
+# Значения не содержат '<' и '>', поэтому незакрытый тег в хвосте потока начинается с последнего '<'.
+TOKEN = re.compile(
+    r'<(действий|действие|instrument|direction|amount|leverage|close_trade)=([^<>]*)>'
+    r'|<comment>([^<]*)</comment>'
+    r'|<(/?)think>'
+)
+IDS = re.compile(r'[^\s,;]+')
+# Сумма с разделителями разрядов: 1,000 / 12,500.50 / 1 000
+COMMA_GROUPED = re.compile(r'\d{1,3}(?:,\d{3})+(?:\.\d+)?')
+SPACE_GROUPED = re.compile(r'\d{1,3}(?: \d{3})+(?:[.,]\d+)?')
+# Начала тегов: недочитанный хвост потока держим, только если он может оказаться одним из них
+OPENERS = tuple(f'<{name}=' for name in ('действий', 'действие', 'instrument', 'direction', 'amount',
+                                          'leverage', 'close_trade')) + ('<comment>', '<think>', '</think>')
+# Дольше этого значение тега или комментарий не бывают - такой хвост уже не тег
+TAIL_MAX = 1024
+
+# Теги, без которых команда неполна
+REQUIRED_TAGS = {
+    'open': ('instrument', 'direction', 'amount', 'leverage'),
+    'close': ('close_trade',),
+    # Ожидание не срочно - дожидаемся комментария
+    'wait': ('comment',),
+}
+DIRECTIONS = ('buy', 'sell')
+
+
+def _amount(value):
+    """Сумма сделки не меньше MIN_TRADE_AMOUNT; мусор и неоднозначная запись - None"""
+    value = value.strip().lstrip('$').strip()
+    # 1,000 / 1 000 - разделители разрядов, а не дробная часть
+    if COMMA_GROUPED.fullmatch(value):
+        value = value.replace(',', '')
+    elif SPACE_GROUPED.fullmatch(value):
+        value = value.replace(' ', '').replace(',', '.')
+    elif value.count(',') == 1 and '.' not in value:
+        # Десятичная запятая: 12,5
+        value = value.replace(',', '.')
+    try:
+        amount = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(amount) or amount <= 0:
+        return None
+    return max(amount, float(MIN_TRADE_AMOUNT))
+
+
+def _leverage(value):
+    """Плечо в пределах 1..MAX_LEVERAGE; мусор - None"""
+    try:
+        leverage = float(value.strip('xх'))
+    except ValueError:
+        return None
+    if not math.isfinite(leverage):
+        return None
+    return min(max(int(leverage), 1), MAX_LEVERAGE)
+
+
+def _pending(text, end):
+    """Хвост после end, который еще может стать тегом или комментарием; иначе пустая строка"""
+    opened = text.rfind('<comment>', end)
+    if opened != -1:
+        body = text[opened + len('<comment>'):]
+        inner = body.find('<')
+        # Внутри комментария '<' допустим только как начало закрывающего тега
+        if len(body) <= TAIL_MAX and (inner == -1 or '</comment>'.startswith(body[inner:])):
+            return text[opened:]
+    start = text.rfind('<', end)
+    if start == -1:
+        return ""
+    tail = text[start:]
+    if len(tail) > TAIL_MAX or '>' in tail:
+        return ""
+    if any(opener.startswith(tail) or tail.startswith(opener) for opener in OPENERS):
+        return tail
+    return ""
+
+
+class Record:
+    """Типизированная запись со слотами, которая читается и как прежний dict"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.as_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+
+class Action(Record):
+    """Один блок <действие=...> со своими тегами"""
+
+    __slots__ = ('action', 'instrument', 'direction', 'amount', 'leverage', 'close_trade')
+
+    def __init__(self, action):
+        self.action = action
+        self.instrument = None
+        self.direction = None
+        self.amount = None
+        self.leverage = None
+        # Кортеж id: <close_trade> принимает список через запятую
+        self.close_trade = ()
+
+    def set(self, tag, value):
+        if tag == 'instrument':
+            self.instrument = value.upper() or None
+        elif tag == 'direction':
+            value = value.lower()
+            self.direction = value if value in DIRECTIONS else None
+        elif tag == 'amount':
+            self.amount = _amount(value)
+        elif tag == 'leverage':
+            self.leverage = _leverage(value)
+        elif tag == 'close_trade':
+            self.close_trade = tuple(IDS.findall(value))
+
+    def is_complete(self, comment):
+        required = REQUIRED_TAGS.get(self.action)
+        if required is None:
+            return False
+        # Комментарий общий на весь ответ, остальные теги - свои у каждого действия
+        return all(comment if tag == 'comment' else getattr(self, tag) for tag in required)
+
+    def orders(self):
+        if self.action == 'close':
+            return [Order('close', close_trade=trade_id) for trade_id in self.close_trade]
+        if self.action in (None, 'wait'):
+            return []
+        return [Order(self.action, self.instrument, self.direction, self.amount, self.leverage)]
+
+
+class Order(Record):
+    """Ордер к исполнению: открытие или закрытие одной сделки"""
+
+    __slots__ = ('action', 'instrument', 'direction', 'amount', 'leverage', 'close_trade', 'key')
+
+    def __init__(self, action, instrument=None, direction=None, amount=None, leverage=None, close_trade=None):
+        self.action = action
+        self.instrument = instrument
+        self.direction = direction
+        self.amount = amount
+        self.leverage = leverage
+        self.close_trade = close_trade
+        self.key = None
+
+
+class Commands(Record):
+    """Разобранный ответ ИИ.
+
+    Поля первого действия доступны на верхнем уровне, 'orders' - все ордера по одному.
+    Сверх объявленных <действий=N> блоки не исполняются.
+    """
+
+    __slots__ = ('action', 'instrument', 'direction', 'amount', 'leverage', 'close_trade',
+                 'comment', 'expected', 'actions', 'orders')
+
+    def __init__(self, comment, expected, actions):
+        actions = actions[:expected]
+        first = actions[0] if actions else Action(None)
+        self.action = first.action
+        self.instrument = first.instrument
+        self.direction = first.direction
+        self.amount = first.amount
+        self.leverage = first.leverage
+        self.close_trade = ",".join(first.close_trade) or None
+        self.comment = comment
+        self.expected = expected
+        self.actions = actions
+        self.orders = [order for action in actions for order in action.orders()]
+
+
+class CommandParser:
+    """Однопроходный разбор ответа ИИ, в том числе по кускам потока.
+
+    Каждый символ сканируется один раз: feed() продолжает с места, где закончился
+    прошлый кусок, повторно читается только незакрытый тег в хвосте.
+    Теги внутри <think>...</think> - черновики рассуждений, в счет идет финальный ответ.
+    Черновики бывают и в обычном тексте: каждый <действий=N> и каждый блок сверх
+    объявленных начинают новый набор действий, в счет идет последний полный.
+    """
+
+    def __init__(self):
+        # Непрочитанный хвост; весь ответ целиком не копится
+        self.tail = ""
+        self.thinking = False
+        # Последний полный набор (comment, expected, actions) - если следующий оборвется
+        self.complete = None
+        self.reset()
+
+    def reset(self):
+        self.comment = None
+        self.expected = 1
+        self.actions = []
+
+    def restart(self, expected=1):
+        """Новый набор действий; полный предыдущий запоминается"""
+        if self.is_complete():
+            self.complete = (self.comment, self.expected, self.actions)
+        self.reset()
+        self.expected = expected
+
+    def feed(self, chunk):
+        text = self.tail + chunk
+        end = 0
+        for match in TOKEN.finditer(text):
+            end = match.end()
+            tag, value, comment, think = match.groups()
+            if think is not None:
+                # Черновые теги внутри рассуждений не исполняются
+                self.thinking = not think
+                self.complete = None
+                self.reset()
+            elif self.thinking:
+                continue
+            elif comment is not None:
+                if self.comment is None:
+                    self.comment = comment.strip() or None
+            elif tag == 'действий':
+                value = value.strip()
+                self.restart(max(1, int(value)) if value.isdigit() else 1)
+            elif tag == 'действие':
+                if len(self.actions) >= self.expected:
+                    self.restart(self.expected)
+                self.actions.append(Action(value.strip().lower() or None))
+            elif self.actions:
+                # Тег до первого <действие=...> ни к чему не относится
+                action = self.actions[-1]
+                if getattr(action, tag) in (None, ()):
+                    action.set(tag, value.strip())
+        # Заново читается только хвост, где может быть незакрытый тег или комментарий
+        self.tail = _pending(text, end)
+        return self
+
+    def is_complete(self):
+        """В тексте уже есть все объявленные действия с полным набором тегов"""
+        actions = self.actions[:self.expected]
+        return len(actions) == self.expected and all(a.is_complete(self.comment) for a in actions)
+
+    def result(self):
+        if self.complete is not None and not self.is_complete():
+            comment, expected, actions = self.complete
+            return Commands(comment, expected, list(actions))
+        return Commands(self.comment, self.expected, list(self.actions))
+
+
+def parse(text):
+    """Разбор полного ответа ИИ"""
+    return CommandParser().feed(text).result()
+
+
+def sample_response(size):
+    """Ответ reasoning-модели: длинные рассуждения с черновыми тегами, затем финальный ответ"""
+    draft = ("Смотрю на BTCUSDT: RSI 71, цена выше EMA. Возможно <действие=open> <amount=50>, "
+             "но сначала проверю позиции, <close_trade=1> пока держу.\n")
+    reasoning = (draft * (size // len(draft) + 1))[:size]
+    return (f"<think>{reasoning}</think>\n<действий=2>\n"
+            "<действие=close>\n<close_trade=4440266, 4440267>\n"
+            "<действие=open>\n<instrument=ETHUSDT>\n<direction=buy>\n<amount=100>\n<leverage=20>\n"
+            "<comment>Фиксирую прибыль и открываю ETH по тренду</comment>")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Микробенчмарк разбора ответов ИИ")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000, 200000],
+                        help="символов рассуждений в ответе")
+    parser.add_argument("--chunk", type=int, default=8, help="символов в куске потока")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--naive-limit", type=int, default=10000, help="кусков, до которых мерить разбор заново")
+    args = parser.parse_args()
+
+    print(f"{'символов':>9} {'разбор, мс':>11} {'поток, мс':>10} {'поток заново, мс':>17}")
+    for size in args.sizes:
+        text = sample_response(size)
+        chunks = [text[i:i + args.chunk] for i in range(0, len(text), args.chunk)]
+        assert len(parse(text).orders) == 3
+
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            parse(text)
+        full = (time.perf_counter() - started) / args.repeat
+
+        started = time.perf_counter()
+        stream = CommandParser()
+        for chunk in chunks:
+            stream.feed(chunk).is_complete()
+        streamed = time.perf_counter() - started
+
+        # Для сравнения: полный разбор накопленного текста на каждом куске, как было раньше
+        naive = None
+        if len(chunks) <= args.naive_limit:
+            started = time.perf_counter()
+            text_so_far = ""
+            for chunk in chunks:
+                text_so_far += chunk
+                CommandParser().feed(text_so_far).is_complete()
+            naive = time.perf_counter() - started
+
+        print(f"{len(text):>9} {full * 1000:>11.3f} {streamed * 1000:>10.2f} "
+              f"{'-' if naive is None else f'{naive * 1000:.1f}':>17}")
@@ -3,19 +3,124 @@ TRADING_API_KEY = "acamzlj3t7SLB*****10g9PXoA"
 AI_API_KEY = "sk-aitunFfIa****Lzi"  # Ваш ключ из aitunnel либо chatgpt
 AI_BASE_URL = "https://api.aitunnel.ru/v1/"
 AI_MODEL = "deepseek-r1"  # Модель deepseek
+# Провайдеры ИИ для хеджированных запросов (OpenAI-совместимые), первый - основной
+AI_PROVIDERS = [
+    {"name": "aitunnel", "base_url": AI_BASE_URL, "api_key": AI_API_KEY, "model": AI_MODEL},
+]
+AI_HEDGE_MIN_DELAY = 5  # секунд до хедж-запроса, пока нет статистики p95
+AI_BREAKER_FAILURES = 3  # ошибок подряд до отключения провайдера
+AI_BREAKER_COOLDOWN = 60  # секунд отключения
+AI_STREAM = True  # потоковый ответ с досрочным разбором команды
+AI_DEADLINE = 60  # секунд на ответ ИИ
+AI_TOKEN_BUDGET = 8000  # токенов (включая рассуждения) до обрыва потока
+AI_CHARS_PER_TOKEN = 3  # оценка токенов по длине текста, пока провайдер не прислал usage
 
 # Настройки торговли
 DEFAULT_WALLET = "DOLLR"
-MAX_INSTRUMENTS = 10
+# Аккаунты для accounts.py: у каждого свой ключ, кошелек и, при желании, свой промпт-стратегия
+ACCOUNTS = [
+    {"name": "main", "api_key": TRADING_API_KEY, "wallet": DEFAULT_WALLET},
+]
+FEED_QUOTES_INTERVAL = 1  # секунд, общий поток котировок для всех аккаунтов
+FEED_CANDLES_INTERVAL = 5  # секунд, догрузка свечей в общее хранилище
+WORKER_RESTART_DELAY = 10  # секунд до перезапуска упавшего процесса аккаунта
+MAX_INSTRUMENTS = 10  # инструментов в промпте после скрининга (плюс открытые позиции)
+SCREEN_CANDIDATES = 40  # кандидатов после отбора по котировкам, для них грузится история
+SCREEN_MOMENTUM_WINDOW = 15  # минут, из RETURN_WINDOWS
+SCREEN_MOMENTUM_WEIGHT = 1.0
+SCREEN_VOLATILITY_WEIGHT = 0.5
+SCREEN_SPREAD_WEIGHT = 1.0
 REQUEST_TIMEOUT = 30
+HTTP_POOL_SIZE = 16  # соединений в пуле на хост
+HTTP2 = False  # требует pip install httpx[http2]
+# Лимиты запросов по семействам эндпоинтов: (запросов в секунду, размер пачки)
+RATE_LIMITS = {
+    'orders': (5, 5),
+    'trades': (5, 10),
+    'market': (10, 20),
+    'session': (2, 4),
+}
+RATE_LIMIT_GLOBAL = (20, 20)  # общий лимит на все запросы к платформе
+RETRY_MAX = 3  # повторов при 429/5xx
+RETRY_BASE_DELAY = 0.5  # секунд, база экспоненциальной паузы
+RETRY_MAX_DELAY = 30  # секунд, потолок паузы
 
 # Базовый URL торгового API
 TRADING_BASE_URL = "https://tb-ru.tontrader.com/api/v1"
 
 # Временные интервалы
 UPDATE_INTERVAL = 30  # секунд
+QUOTES_TTL = 5  # секунд, срок годности снимка котировок
+PREFETCH_INTERVAL = 5  # секунд до обновления данных во время вызова ИИ, пока нет p95 провайдеров
+PREFETCH_MAX_AGE = 5  # секунд, предзагруженный снимок годится для следующего цикла
+PRICE_TOLERANCE = 0.3  # %, допустимый сдвиг цены между решением ИИ и исполнением
+# Событийный запуск ИИ вместо фиксированного таймера
+EVENT_DRIVEN = True  # False - цикл ИИ строго раз в UPDATE_INTERVAL
+EVENT_POLL_INTERVAL = 1  # секунд между дешевыми проверками котировок
+EVENT_MIN_INTERVAL = 10  # секунд минимум между вызовами ИИ
+EVENT_MAX_IDLE = 120  # секунд, после которых ИИ вызывается и без событий
+EVENT_ATR_MULT = 1.5  # движение цены от точки решения, в ATR
+EVENT_PNL_LEVELS = (-10, -8, -5, 5, 15, 20, 25)  # пороги PnL в %, пересечение будит ИИ
 HISTORY_COUNT = 30
+CANDLE_CAPACITY = 1000  # m1-баров в кэше на символ
+
+# Индикаторы (в барах m1)
+EMA_FAST = 9
+EMA_SLOW = 21
+SMA_PERIOD = 50
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+LEVELS_WINDOW = 240  # окно для поддержки/сопротивления и VWAP
+RETURN_WINDOWS = (5, 15, 60)
+
+# Параллельный сбор данных
+FETCH_CONCURRENCY = 8  # одновременных запросов
+CYCLE_DEADLINE = 20  # секунд на сбор данных цикла
+
+# Локальный журнал закрытых сделок
+JOURNAL_PATH = "trades.db"
+JOURNAL_OVERLAP = 300  # секунд, перекрытие окна синхронизации
+STORE_DIR = "market_data"  # хранилище свечей и котировок; None - не сохранять
+STORE_RETENTION = 30 * 24 * 3600  # секунд истории свечей после сжатия
+STORE_QUOTES_RETENTION = 7 * 24 * 3600  # секунд истории котировок после сжатия
+STORE_QUOTES_QUEUE = 100  # снимков котировок в очереди фоновой записи
+
+# Риск-монитор (PnL в % от суммы сделки)
+RISK_STOP_LOSS = 10  # немедленное закрытие, как требует prompt.txt
+RISK_TAKE_PROFIT = 25
+RISK_TRAILING_START = 15  # трейлинг включается после такого PnL
+RISK_TRAILING = 5  # откат от пика PnL для закрытия
+RISK_POLL_INTERVAL = 1  # секунд
+RISK_TRADES_REFRESH = 10  # секунд, пересинхронизация списка активных сделок
+
+# Исполнение ордеров
+ORDER_CONCURRENCY = 4  # ордеров пачки отправляются одновременно
+ORDER_DEDUP_TTL = 60  # секунд, повтор исполненного ордера с тем же ключом отбрасывается
+
+# Промпт
+PROMPT_PATH = "prompt.txt"
+PROMPT_TOKEN_BUDGET = 3000  # токенов на данные одного цикла
+PROMPT_CONTEXT_BUDGET = 20000  # токенов переписки, после - снова полный снимок
+PROMPT_HISTORY_BARS = 10  # закрытий m1 на символ в промпте
+PROMPT_DELTA = True  # слать только изменения в рамках переписки
+
+# Кэш решений ИИ
+DECISION_TTL = 180  # секунд
+DECISION_CACHE_SIZE = 64
+DECISION_PNL_BUCKET = 2  # % PnL
+DECISION_PRICE_BAND = 0.2  # % цены
+DECISION_RSI_BUCKET = 10
+
+# Метрики
+METRICS_PORT = 9108  # http://127.0.0.1:9108/metrics, None - не поднимать
+METRICS_LOG_PATH = "metrics.jsonl"
+METRICS_LOG_BYTES = 10 * 1024 * 1024
+METRICS_LOG_BACKUPS = 5
 
 # Лимиты
 MIN_TRADE_AMOUNT = 10
 MAX_LEVERAGE = 100
+
+# Бэктест
+BACKTEST_BALANCE = 1000
+BACKTEST_COMMISSION = 0.0005  # доля от объема позиции
@@ -0,0 +1,78 @@
+import math
+import time
+from collections import OrderedDict
+from config import (DECISION_TTL, DECISION_CACHE_SIZE, DECISION_PNL_BUCKET,
+                    DECISION_PRICE_BAND, DECISION_RSI_BUCKET)
+
+
+def bucket(value, step):
+    """Номер корзины значения с шагом step (None остается None)"""
+    if value is None:
+        return None
+    return math.floor(value / step)
+
+
+def price_bucket(rate, band=DECISION_PRICE_BAND):
+    """Корзина цены в логарифмической шкале: ширина band% на любом уровне цены"""
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError):
+        return None
+    if rate <= 0:
+        return None
+    return math.floor(math.log(rate) / math.log(1 + band / 100))
+
+
+class DecisionCache:
+    """Кэш решений ИИ по квантованному состоянию рынка: TTL + LRU"""
+
+    def __init__(self, ttl=DECISION_TTL, max_size=DECISION_CACHE_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, market_data):
+        """Отпечаток состояния: позиции, корзины PnL, цены и индикаторов, число закрытых сделок"""
+        positions = tuple(sorted(
+            (str(t['id']), t['instrument'], t['direction'], bucket(t['profit_percent'], DECISION_PNL_BUCKET))
+            for t in market_data['active_trades']
+        ))
+        instruments = tuple(
+            (
+                inst['symbol'],
+                inst.get('is_trading_open'),
+                price_bucket(inst.get('current_rate')),
+                inst.get('trend'),
+                bucket((inst.get('indicators') or {}).get('rsi'), DECISION_RSI_BUCKET),
+            )
+            for inst in market_data['instruments']
+        )
+        closed_count = market_data['closed_trades_stats']['total_count']
+        return (positions, instruments, closed_count, tuple(market_data.get('stale', [])))
+
+    def get(self, key):
+        """Сохраненный ответ ИИ для отпечатка, если он не устарел (ttl <= 0 - кэш выключен)"""
+        entry = self.entries.get(key) if self.ttl > 0 else None
+        if entry is not None and self.clock() - entry[0] <= self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, response):
+        if self.ttl <= 0:
+            return
+        self.entries[key] = (self.clock(), response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total * 100 if total else 0.0
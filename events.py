@@ -0,0 +1,130 @@
+import bisect
+import time
+from api import calc_trade_profit
+from candles import BAR_SECONDS
+from config import (EVENT_ATR_MULT, EVENT_PNL_LEVELS, EMA_FAST, EMA_SLOW)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EventEngine:
+    """Дешевое наблюдение за котировками между вызовами ИИ: причины разбудить ИИ раньше таймера.
+
+    Состояние «взводится» по снимку, на котором ИИ принял последнее решение; дальше каждая
+    проверка - только снимок котировок и арифметика, без запросов истории и без ИИ.
+    """
+
+    def __init__(self, api, risk=None, atr_mult=EVENT_ATR_MULT, pnl_levels=EVENT_PNL_LEVELS, clock=time.time):
+        self.api = api
+        self.risk = risk
+        self.atr_mult = atr_mult
+        self.pnl_levels = sorted(pnl_levels)
+        self.clock = clock
+        self.symbols = {}
+        self.trades = {}
+        self.gone = set()
+        self.armed_at = None
+
+    def arm(self, market_data):
+        """Запомнить состояние, которое видел ИИ"""
+        self.symbols = {}
+        for inst in market_data['instruments']:
+            ind = inst.get('indicators') or {}
+            rate = _float(inst.get('current_rate'))
+            if rate is None:
+                continue
+            self.symbols[inst['symbol']] = {
+                'ref': rate,
+                'atr': ind.get('atr'),
+                'ema_fast': ind.get('ema_fast'),
+                'ema_slow': ind.get('ema_slow'),
+                'bar': int(self.clock() // BAR_SECONDS),
+                'last': rate,
+            }
+        # Уровень считается той же формулой, что и в check(), иначе расхождение само станет событием
+        quotes = market_data['quotes']
+        self.trades = {}
+        for t in market_data['active_trades']:
+            percent = self.percent(t, quotes.rate(t['instrument']))
+            self.trades[str(t['id'])] = dict(
+                t, level=None if percent is None else bisect.bisect(self.pnl_levels, percent))
+        self.gone = set()
+        self.armed_at = self.clock()
+
+    @staticmethod
+    def percent(trade, rate):
+        """PnL сделки в % при цене rate или None"""
+        amount = _float(trade['amount'])
+        if not rate or not amount:
+            return None
+        return calc_trade_profit(trade, rate) / amount * 100
+
+    def forget(self, trade_id):
+        """Сделку закрыл сам бот - это не событие рынка"""
+        self.trades.pop(str(trade_id), None)
+        self.gone.add(str(trade_id))
+
+    def trend_flip(self, state, rate):
+        """Довести EMA до текущего бара по закрытиям; True, если быстрая пересекла медленную"""
+        if state['ema_fast'] is None or state['ema_slow'] is None:
+            return False
+        bar = int(self.clock() // BAR_SECONDS)
+        was_up = state['ema_fast'] > state['ema_slow']
+        # Закрытие завершившегося бара - последняя цена, увиденная до его конца
+        for _ in range(min(bar - state['bar'], EMA_SLOW)):
+            state['ema_fast'] += 2 / (EMA_FAST + 1) * (state['last'] - state['ema_fast'])
+            state['ema_slow'] += 2 / (EMA_SLOW + 1) * (state['last'] - state['ema_slow'])
+        state['bar'] = bar
+        state['last'] = rate
+        return (state['ema_fast'] > state['ema_slow']) != was_up and state['ema_fast'] != state['ema_slow']
+
+    def check(self, max_age=None):
+        """Список сработавших триггеров (kind, описание) по свежему снимку котировок"""
+        if self.armed_at is None:
+            return []
+        quotes = self.api.get_quotes() if max_age is None else self.api.get_quotes(max_age=max_age)
+        events = []
+
+        for symbol, state in self.symbols.items():
+            rate = quotes.rate(symbol)
+            if not rate:
+                continue
+            if state['atr'] and abs(rate - state['ref']) >= self.atr_mult * state['atr']:
+                events.append(('price', f"{symbol} сдвинулся на {(rate / state['ref'] - 1) * 100:+.2f}% "
+                                        f"(> {self.atr_mult}×ATR)"))
+                # Повторно по тому же движению не будим
+                state['ref'] = rate
+            if self.trend_flip(state, rate):
+                trend = "вверх" if state['ema_fast'] > state['ema_slow'] else "вниз"
+                events.append(('trend', f"{symbol}: смена тренда {trend}"))
+
+        if self.risk is not None:
+            with self.risk.lock:
+                active = dict(self.risk.trades)
+            # Сделки, открытые после взвода, берем под наблюдение без события
+            for trade_id, trade in active.items():
+                if trade_id not in self.trades and trade_id not in self.gone:
+                    self.trades[trade_id] = dict(trade, level=None)
+
+        for trade_id, trade in self.trades.items():
+            percent = self.percent(trade, quotes.rate(trade['instrument']))
+            if percent is None:
+                continue
+            level = bisect.bisect(self.pnl_levels, percent)
+            if trade['level'] is None:
+                trade['level'] = level
+            elif level != trade['level']:
+                events.append(('pnl', f"сделка {trade_id} {trade['instrument']}: PnL {percent:+.1f}%"))
+                trade['level'] = level
+
+        if self.risk is not None and self.risk.trades_at > self.armed_at:
+            # Список активных сделок риск-монитор обновляет сам - лишних запросов нет
+            for trade_id in [t for t in self.trades if t not in active]:
+                events.append(('closed', f"сделка {trade_id} закрыта"))
+                self.forget(trade_id)
+        return events
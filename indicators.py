@@ -0,0 +1,212 @@
+import math
+import warnings
+import numpy as np
+from config import (EMA_FAST, EMA_SLOW, SMA_PERIOD, RSI_PERIOD, ATR_PERIOD,
+                    LEVELS_WINDOW, RETURN_WINDOWS, HISTORY_COUNT)
+
+# Баров в блоке EMA: матрица весов блока x блок, степени затухания еще не теряют точность
+EMA_BLOCK = 64
+# Вклад бара в EMA, ниже которого он уже не влияет на последнее значение
+EMA_TOLERANCE = 1e-9
+
+
+def to_columns(candles_by_symbol, length=None):
+    """Свечи всех символов в колоночные массивы (символы x бары), выравнивание по правому краю"""
+    symbols = [s for s, bars in candles_by_symbol.items() if bars]
+    if length is None:
+        length = max((len(candles_by_symbol[s]) for s in symbols), default=0)
+
+    columns = {key: np.full((len(symbols), length), np.nan) for key in 'ohlcv'}
+    for row, symbol in enumerate(symbols):
+        bars = candles_by_symbol[symbol][-length:]
+        n = len(bars)
+        for key in 'ohlcv':
+            # Значения приходят строками из JSON - одна конверсия на бар
+            columns[key][row, length - n:] = np.fromiter(
+                (float(bar[key]) if bar.get(key) is not None else np.nan for bar in bars),
+                dtype=float, count=n
+            )
+    return symbols, columns
+
+
+def sma(x, period):
+    """Простая скользящая средняя по последней оси"""
+    out = np.full_like(x, np.nan)
+    if x.shape[1] < period:
+        return out
+    csum = np.cumsum(np.nan_to_num(x), axis=1)
+    csum = np.concatenate([np.zeros((x.shape[0], 1)), csum], axis=1)
+    out[:, period - 1:] = (csum[:, period:] - csum[:, :-period]) / period
+    # Окна с пропусками (короткая история символа) не считаем
+    valid = np.cumsum(np.isnan(x), axis=1)
+    valid = np.concatenate([np.zeros((x.shape[0], 1)), valid], axis=1)
+    out[:, period - 1:][(valid[:, period:] - valid[:, :-period]) > 0] = np.nan
+    return out
+
+
+def _ema_blocks(x, acc, alpha):
+    """EMA ряда без пропусков: внутри блока рекурсия раскрыта в умножение на треугольную матрицу"""
+    n = x.shape[1]
+    size = min(EMA_BLOCK, n)
+    decay = 1 - alpha
+    lags = np.arange(size)[None, :] - np.arange(size)[:, None]
+    weights = np.where(lags >= 0, alpha * decay ** np.clip(lags, 0, None), 0.0)
+    carry = decay ** np.arange(1, size + 1)
+    out = np.empty_like(x)
+    for start in range(0, n, size):
+        block = x[:, start:start + size]
+        m = block.shape[1]
+        out[:, start:start + m] = block @ weights[:m, :m] + acc[:, None] * carry[:m]
+        acc = out[:, start + m - 1]
+    return out
+
+
+def ema(x, period=None, alpha=None):
+    """Экспоненциальная средняя по последней оси, векторно по всем символам"""
+    alpha = 2 / (period + 1) if alpha is None else alpha
+    out = np.full_like(x, np.nan)
+    n = x.shape[1]
+    if x.size == 0:
+        return out
+    valid = ~np.isnan(x)
+    first = np.argmax(valid, axis=1)
+    present = valid[np.arange(x.shape[0]), first]
+    # Пропуски после начала истории (бар без цены) - редкость, такие ряды считаются отдельно
+    gaps = present & (valid.sum(axis=1) < n - first)
+    rows = present & ~gaps
+    if rows.all() and not first.any():
+        # Обычный случай: у всех символов полная история без пропусков
+        return _ema_blocks(x, x[:, 0], alpha)
+    if rows.any():
+        xs = x[rows]
+        begun = np.arange(n)[None, :] >= first[rows][:, None]
+        seed = xs[np.arange(len(xs)), first[rows]]
+        # До первого значения ряд продолжен им самим: EMA константы равна ей, дальше результат тот же
+        values = _ema_blocks(np.where(begun, xs, seed[:, None]), seed, alpha)
+        out[rows] = np.where(begun, values, np.nan)
+    for row in np.flatnonzero(gaps):
+        idx = np.flatnonzero(valid[row])
+        values = _ema_blocks(x[row, idx][None, :], x[row, idx[:1]], alpha)[0]
+        # На пропуске средняя стоит на месте - значение по последнему известному бару
+        last = np.searchsorted(idx, np.arange(first[row], n), side='right') - 1
+        out[row, first[row]:] = values[last]
+    return out
+
+
+def ema_window(period=None, alpha=None):
+    """Сколько последних баров нужно для последнего значения EMA с точностью EMA_TOLERANCE"""
+    alpha = 2 / (period + 1) if alpha is None else alpha
+    return int(math.ceil(math.log(EMA_TOLERANCE) / math.log(1 - alpha)))
+
+
+def rsi(close, period=RSI_PERIOD):
+    """RSI Уайлдера"""
+    delta = np.diff(close, axis=1, prepend=np.nan)
+    gain = np.where(np.isnan(delta), np.nan, np.clip(delta, 0, None))
+    loss = np.where(np.isnan(delta), np.nan, np.clip(-delta, 0, None))
+    avg_gain = ema(gain, alpha=1 / period)
+    avg_loss = ema(loss, alpha=1 / period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain / avg_loss
+        return np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + rs))
+
+
+def atr(high, low, close, period=ATR_PERIOD):
+    """Average True Range"""
+    prev_close = np.roll(close, 1, axis=1)
+    prev_close[:, 0] = np.nan
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    return ema(true_range, alpha=1 / period)
+
+
+def last_valid(x):
+    """Последнее не-NaN значение каждой строки"""
+    mask = ~np.isnan(x)
+    idx = x.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+    values = x[np.arange(x.shape[0]), idx]
+    return np.where(mask.any(axis=1), values, np.nan)
+
+
+def first_valid(x):
+    """Первое не-NaN значение каждой строки"""
+    mask = ~np.isnan(x)
+    values = x[np.arange(x.shape[0]), np.argmax(mask, axis=1)]
+    return np.where(mask.any(axis=1), values, np.nan)
+
+
+def compute(candles_by_symbol):
+    """Все индикаторы для всех символов одним батчем; {символ: {индикатор: значение}}"""
+    return compute_columns(*to_columns(candles_by_symbol))
+
+
+def compute_columns(symbols, col):
+    """Индикаторы по готовым матрицам o/h/l/c/v (например, из MarketStore.to_columns)"""
+    if not symbols:
+        return {}
+    close, high, low, volume = col['c'], col['h'], col['l'], col['v']
+    n = close.shape[1]
+
+    last_close = last_valid(close)
+    # Нужны только последние значения: EMA-индикаторы считаем по хвосту, где еще виден вклад баров
+    ema_fast = last_valid(ema(close[:, -ema_window(EMA_FAST):], EMA_FAST))
+    ema_slow = last_valid(ema(close[:, -ema_window(EMA_SLOW):], EMA_SLOW))
+    sma_last = last_valid(sma(close, SMA_PERIOD))
+    tail = ema_window(alpha=1 / RSI_PERIOD) + 1
+    rsi_last = last_valid(rsi(close[:, -tail:]))
+    tail = ema_window(alpha=1 / ATR_PERIOD) + 1
+    atr_last = last_valid(atr(high[:, -tail:], low[:, -tail:], close[:, -tail:]))
+
+    # Символы без объема или с короткой историей дают NaN, предупреждения не нужны
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        atr_percent = atr_last / last_close * 100
+        log_ret = np.diff(np.log(close), axis=1)
+        volatility = np.nanstd(log_ret[:, -HISTORY_COUNT:], axis=1) * 100
+
+        window = slice(max(0, n - LEVELS_WINDOW), n)
+        typical = (high[:, window] + low[:, window] + close[:, window]) / 3
+        vwap = np.nansum(typical * volume[:, window], axis=1) / np.nansum(volume[:, window], axis=1)
+        support = np.nanmin(low[:, window], axis=1)
+        resistance = np.nanmax(high[:, window], axis=1)
+
+        returns = {}
+        for k in RETURN_WINDOWS:
+            base = close[:, -k - 1] if n > k else np.full(len(symbols), np.nan)
+            returns[k] = (last_close / base - 1) * 100
+
+        start = first_valid(close[:, -HISTORY_COUNT:])
+        trend_change = (last_close / start - 1) * 100
+
+    def value(arr, row):
+        v = arr[row]
+        return None if np.isnan(v) else float(v)
+
+    result = {}
+    for row, symbol in enumerate(symbols):
+        result[symbol] = {
+            'ema_fast': value(ema_fast, row),
+            'ema_slow': value(ema_slow, row),
+            'sma': value(sma_last, row),
+            'rsi': value(rsi_last, row),
+            'atr': value(atr_last, row),
+            'atr_percent': value(atr_percent, row),
+            'volatility': value(volatility, row),
+            'vwap': value(vwap, row),
+            'support': value(support, row),
+            'resistance': value(resistance, row),
+            'returns': {k: value(returns[k], row) for k in RETURN_WINDOWS},
+            'trend_change': value(trend_change, row),
+        }
+    return result
+
+
+def trend_label(ind):
+    """Тренд по пересечению быстрой и медленной EMA"""
+    fast, slow = ind.get('ema_fast'), ind.get('ema_slow')
+    if fast is None or slow is None:
+        return None
+    if fast > slow:
+        return "📈 ВОСХОДЯЩИЙ"
+    if fast < slow:
+        return "📉 НИСХОДЯЩИЙ"
+    return "➡️ БОКОВОЙ"
@@ -0,0 +1,138 @@
+import json
+import sqlite3
+import threading
+import time
+from config import JOURNAL_PATH, JOURNAL_OVERLAP
+
+
+class TradeJournal:
+    """Локальный журнал закрытых сделок с курсором синхронизации и агрегатами"""
+
+    def __init__(self, path=JOURNAL_PATH, clock=time.time):
+        self.clock = clock
+        # Синхронизация может идти из потока сборщика данных
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS trades (
+                id TEXT PRIMARY KEY,
+                wallet TEXT NOT NULL,
+                instrument TEXT,
+                profit REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS trades_wallet ON trades (wallet, instrument);
+            CREATE TABLE IF NOT EXISTS cursors (
+                wallet TEXT PRIMARY KEY,
+                synced_to INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS aggregates (
+                wallet TEXT NOT NULL,
+                instrument TEXT NOT NULL,
+                total_count INTEGER NOT NULL DEFAULT 0,
+                profitable_count INTEGER NOT NULL DEFAULT 0,
+                losing_count INTEGER NOT NULL DEFAULT 0,
+                total_profit REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (wallet, instrument)
+            );
+        """)
+        self.db.commit()
+
+    def get_cursor(self, wallet):
+        """Время (мс), до которого журнал уже синхронизирован"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT synced_to FROM cursors WHERE wallet = ?", (wallet,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def sync(self, api, wallet):
+        """Догрузить только новые закрытые сделки, вернуть список добавленных"""
+        cursor = self.get_cursor(wallet)
+        # Небольшое перекрытие окна: дубликаты отсекаются по id сделки
+        from_time = max(0, cursor - JOURNAL_OVERLAP * 1000) if cursor else 0
+        to_time = int(self.clock() * 1000)
+
+        closed_trades = api.get_closed_trades(wallet, from_time, to_time)
+        if not closed_trades or 'trades' not in closed_trades:
+            # Курсор не двигаем, попробуем то же окно в следующем цикле
+            return []
+
+        return self.add_trades(wallet, closed_trades['trades'], synced_to=to_time)
+
+    def add_trades(self, wallet, trades, synced_to=None):
+        """Записать сделки в журнал и обновить агрегаты только по новым"""
+        added = []
+        with self.lock, self.db:
+            for trade in trades:
+                profit = float(trade.get('profit', 0) or 0)
+                instrument = trade.get('instrument', '')
+                inserted = self.db.execute(
+                    "INSERT OR IGNORE INTO trades (id, wallet, instrument, profit, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (str(trade['id']), wallet, instrument, profit,
+                     json.dumps(trade, ensure_ascii=False))
+                ).rowcount
+                if not inserted:
+                    continue
+
+                self.db.execute(
+                    "INSERT INTO aggregates (wallet, instrument, total_count, "
+                    "profitable_count, losing_count, total_profit) VALUES (?, ?, 1, ?, ?, ?) "
+                    "ON CONFLICT (wallet, instrument) DO UPDATE SET "
+                    "total_count = total_count + 1, "
+                    "profitable_count = profitable_count + excluded.profitable_count, "
+                    "losing_count = losing_count + excluded.losing_count, "
+                    "total_profit = total_profit + excluded.total_profit",
+                    (wallet, instrument, int(profit > 0), int(profit < 0), profit)
+                )
+                added.append(trade)
+
+            if synced_to is not None:
+                self.db.execute(
+                    "INSERT INTO cursors (wallet, synced_to) VALUES (?, ?) "
+                    "ON CONFLICT (wallet) DO UPDATE SET synced_to = excluded.synced_to",
+                    (wallet, synced_to)
+                )
+        return added
+
+    def stats(self, wallet, instrument=None):
+        """Статистика закрытых сделок по кошельку (или по одному инструменту)"""
+        query = (
+            "SELECT COALESCE(SUM(total_count), 0), COALESCE(SUM(profitable_count), 0), "
+            "COALESCE(SUM(losing_count), 0), COALESCE(SUM(total_profit), 0) "
+            "FROM aggregates WHERE wallet = ?"
+        )
+        params = [wallet]
+        if instrument is not None:
+            query += " AND instrument = ?"
+            params.append(instrument)
+
+        with self.lock:
+            total_count, profitable, losing, total_profit = self.db.execute(query, params).fetchone()
+        return {
+            'total_count': total_count,
+            'profitable_count': profitable,
+            'losing_count': losing,
+            'total_profit': total_profit
+        }
+
+    def stats_by_instrument(self, wallet):
+        """Агрегаты по каждому инструменту кошелька"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT instrument, total_count, profitable_count, losing_count, total_profit "
+                "FROM aggregates WHERE wallet = ?", (wallet,)
+            ).fetchall()
+        return {
+            row[0]: {
+                'total_count': row[1],
+                'profitable_count': row[2],
+                'losing_count': row[3],
+                'total_profit': row[4]
+            }
+            for row in rows
+        }
+
+    def close(self):
+        self.db.close()
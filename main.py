@@ -1,39 +1,109 @@
 import time
-import json
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime
 from api import TradingAPI
 from ai import AITrader
-from config import UPDATE_INTERVAL, DEFAULT_WALLET, HISTORY_COUNT
+from journal import TradeJournal
+from collector import MarketCollector
+import indicators
+import screener
+from risk import RiskWatcher, protective_prices
+from events import EventEngine
+from decisions import DecisionCache
+from prompts import PromptBuilder
+from orders import InFlightRegistry, OrderExecutor, order_key
+from metrics import metrics
+from config import (UPDATE_INTERVAL, DEFAULT_WALLET, HISTORY_COUNT, CANDLE_CAPACITY,
+                    PREFETCH_INTERVAL, PREFETCH_MAX_AGE, PRICE_TOLERANCE, METRICS_PORT,
+                    METRICS_LOG_PATH, EVENT_DRIVEN, EVENT_POLL_INTERVAL, EVENT_MIN_INTERVAL,
+                    EVENT_MAX_IDLE)
 
 class TradingBot:
-    def __init__(self):
-        self.api = TradingAPI()
-        self.ai = AITrader()
+    def __init__(self, api=None, ai=None, journal=None, clock=time, wallet=DEFAULT_WALLET,
+                 metrics_port=METRICS_PORT, metrics_log=METRICS_LOG_PATH):
+        # Компоненты подменяемы: бэктест передает симулятор API, заглушку ИИ и виртуальные часы,
+        # супервизор аккаунтов - API своего ключа с общими рыночными данными
+        self.api = api or TradingAPI()
+        self.ai = ai or AITrader()
+        self.clock = clock
+        self.wallet = wallet
+        self.metrics_port = metrics_port
+        self.metrics_log = metrics_log
+        self.journal = journal or TradeJournal(clock=clock.time)
+        self.collector = MarketCollector()
+        # Риск-монитор и исполнитель ИИ делят реестр ордеров в полете
+        registry = InFlightRegistry(clock=clock.time)
+        self.orders = OrderExecutor(registry)
+        self.risk = RiskWatcher(self.api, registry=registry, clock=clock.time)
+        self.events = EventEngine(self.api, self.risk, clock=clock.time)
+        self.event_driven = EVENT_DRIVEN
+        self.triggers = []
+        self.decisions = DecisionCache(clock=clock.time)
+        self.prompts = PromptBuilder()
+        # Вызов ИИ идет в фоне, пока основной поток обновляет данные
+        self.ai_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai")
+        self.prefetched = None
+        # Сколько длилась прошлая предзагрузка - на столько раньше p95 ее начинать
+        self.prefetch_seconds = 0.0
+        self.held = set()
         self.stats = {
             'total_trades': 0,
             'profit_trades': 0,
             'loss_trades': 0,
             'total_profit': 0,
-            'active_trades': []
+            'active_trades': [],
+            'cycle_lag': 0.0
         }
     
     def get_market_data(self):
         """Сбор всех данных"""
-        session = self.api.get_session()
-        instruments = self.api.get_instruments()
+        started = time.time()
+        # Один снимок котировок на цикл (инструменты, PnL и проверка команд) и параллельно
+        # список сделок: открытые позиции нужны скринингу до выбора, чью историю грузить
+        first = self.collector.collect({
+            'quotes': (self.api.get_quotes, ()),
+            'active_trades': (self.api.get_active_trades, ()),
+        })
+        quotes = first.get('quotes') or self.api.get_quotes()
+        instruments = quotes.instruments
+        quotes_time = time.time() - started
+        if 'active_trades' not in first.stale:
+            raw_trades = first.get('active_trades')
+            self.held = {t['instrument'] for t in (raw_trades or {}).get('trades', [])}
         
-        # Получаем ВСЕ сделки с реальным PnL
-        all_trades = self.api.get_all_trades_with_profit(DEFAULT_WALLET)
-        active_trades = [t for t in all_trades if t.get('status') == 'active']
-        closed_trades = [t for t in all_trades if t.get('status') == 'closed']
+        # Остальные запросы независимы друг от друга - собираем параллельно
+        tasks = {
+            'session': (self.api.get_session, ()),
+            # Закрытые сделки догружаем в локальный журнал только новыми
+            'journal': (self.journal.sync, (self.api, self.wallet)),
+        }
+        # Историю тянем не для всей вселенной, а для кандидатов по котировкам и открытых позиций
+        candidates = set(screener.prefilter(instruments, self.held))
+        instruments = [inst for inst in instruments if inst['symbol'] in candidates]
+        for instrument in instruments:
+            symbol = instrument['symbol']
+            tasks[f"history:{symbol}"] = (self.api.get_candles, (symbol,))
+        
+        collected = self.collector.collect(tasks, self.collector.deadline - quotes_time)
+        collected.timings['quotes'] = quotes_time
+        collected.timings['active_trades'] = first.timings.get('active_trades', quotes_time)
+        if 'active_trades' in first.stale:
+            collected.stale.add('active_trades')
+        else:
+            collected.results['active_trades'] = self.api.get_active_trades_with_profit(quotes, raw_trades)
+        
+        session = collected.get('session')
+        active_trades = collected.get('active_trades') or []
         
         # Получаем ДЕТАЛЬНУЮ историю цен для ВСЕХ инструментов
         detailed_instruments = []
         price_history = {}
+        candles = {}
         
         for instrument in instruments:
             symbol = instrument['symbol']
-            history = self.api.get_price_history(symbol, HISTORY_COUNT)
+            history = collected.get(f"history:{symbol}")
             
             # Добавляем текущую цену и детали инструмента
             instrument_data = {
@@ -43,21 +113,37 @@ class TradingBot:
                 'ask': instrument.get('ask', ''),
                 'bid': instrument.get('bid', ''),
                 'change_percent': instrument.get('profit_day_pl_percent', ''),
-                'is_trading_open': instrument.get('is_trading_open', False)
+                'is_trading_open': instrument.get('is_trading_open', False),
+                # История не успела к дедлайну - тренд по символу не считаем
+                'stale': collected.is_stale(f"history:{symbol}")
             }
             detailed_instruments.append(instrument_data)
             
-            if history and 'history' in history:
-                recent_prices = history['history'][-20:]
-                price_history[symbol] = recent_prices
-                
-                # Анализ тренда
-                if len(recent_prices) >= 5:
-                    first_price = float(recent_prices[0]['c'])
-                    last_price = float(recent_prices[-1]['c'])
-                    trend = "📈 ВОСХОДЯЩИЙ" if last_price > first_price else "📉 НИСХОДЯЩИЙ" if last_price < first_price else "➡️ БОКОВОЙ"
-                    instrument_data['trend'] = trend
-                    instrument_data['trend_strength'] = abs((last_price - first_price) / first_price * 100)
+            if history:
+                candles[symbol] = history
+                price_history[symbol] = history[-HISTORY_COUNT:]
+        
+        # Индикаторы по всем инструментам одним векторным проходом;
+        # с хранилищем матрицы заполняются прямо из memmap, без разбора строковых цен
+        store = getattr(self.api, 'store', None)
+        if store is not None:
+            all_indicators = indicators.compute_columns(*store.to_columns(list(candles), CANDLE_CAPACITY))
+        else:
+            all_indicators = indicators.compute(candles)
+        for instrument_data in detailed_instruments:
+            ind = all_indicators.get(instrument_data['symbol'])
+            if not ind or len(price_history[instrument_data['symbol']]) < 5:
+                continue
+            instrument_data['indicators'] = ind
+            trend = indicators.trend_label(ind)
+            if trend and ind['trend_change'] is not None:
+                instrument_data['trend'] = trend
+                instrument_data['trend_strength'] = abs(ind['trend_change'])
+        
+        # В промпт - только лучшие по скринингу плюс все инструменты с открытыми позициями
+        detailed_instruments = screener.rank(detailed_instruments, self.held)
+        selected = {inst['symbol'] for inst in detailed_instruments}
+        price_history = {s: bars for s, bars in price_history.items() if s in selected}
         
         # Форматируем активные сделки с РЕАЛЬНЫМ PnL
         formatted_active_trades = []
@@ -74,159 +160,146 @@ class TradingBot:
                 'open_rate': trade['open_rate'],
                 'opened_at': trade['opened_at'],
                 'status': trade['status'],
+                # Нужна для пересчета PnL по котировкам между циклами (events.py)
+                'commission': trade.get('commission', 0),
                 'current_profit': current_profit,
                 'profit_percent': profit_percent,
                 'profit_status': "ПРИБЫЛЬ" if current_profit > 0 else "УБЫТОК" if current_profit < 0 else "БЕЗ ИЗМЕНЕНИЙ"
             }
             formatted_active_trades.append(formatted_trade)
         
-        # Статистика по закрытым сделкам
-        total_closed_profit = sum(float(t.get('profit', 0)) for t in closed_trades)
-        profitable_closed = len([t for t in closed_trades if float(t.get('profit', 0)) > 0])
-        losing_closed = len([t for t in closed_trades if float(t.get('profit', 0)) < 0])
-        
         market_data = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.fromtimestamp(self.clock.time()).isoformat(),
+            'fetched_at': self.clock.time(),
             'balance': session.get('balance', []) if session else [],
             'instruments': detailed_instruments,
+            'universe_size': len(quotes),
+            'quotes': quotes,
             'price_history': price_history,
             'active_trades': formatted_active_trades,  # С реальным PnL!
-            'closed_trades_stats': {
-                'total_count': len(closed_trades),
-                'profitable_count': profitable_closed,
-                'losing_count': losing_closed,
-                'total_profit': total_closed_profit
-            },
+            'closed_trades_stats': self.journal.stats(self.wallet),  # Агрегаты из журнала
             'user_balance': session.get('miner', {}) if session else {},
-            'available_wallet': DEFAULT_WALLET
+            'available_wallet': self.wallet,
+            'stale': sorted(collected.stale),
+            'timings': collected.timings,
+            'collect_time': time.time() - started
         }
         
         return market_data
     
-    def format_ai_prompt(self, market_data):
-        """Формирование промпта для ИИ с РЕАЛЬНЫМ PnL"""
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            prompt = f.read()
-        
-        # Форматируем данные инструментов с ценами
-        instruments_info = []
-        for inst in market_data['instruments']:
-            trend_info = f", {inst.get('trend', '')} ({inst.get('trend_strength', 0):.2f}%)" if inst.get('trend') else ""
-            instruments_info.append(
-                f"{inst['symbol']} ({inst['alias']}): {inst['current_rate']} "
-                f"(ask: {inst['ask']}, bid: {inst['bid']}){trend_info}"
-            )
+    def execute_ai_commands(self, commands, market_data):
+        """Выполнение команд от ИИ с учетом PnL: все ордера ответа уходят параллельно"""
+        comment = commands.get('comment', '')
         
-        # Форматируем активные сделки с РЕАЛЬНЫМ PnL
-        active_trades_info = []
-        for trade in market_data['active_trades']:
-            profit_icon = "🟢" if trade['current_profit'] > 0 else "🔴" if trade['current_profit'] < 0 else "⚪"
-            profit_color = "+" if trade['current_profit'] > 0 else ""
-            
-            active_trades_info.append(
-                f"{profit_icon} ID: {trade['id']} | {trade['instrument']} {trade['direction'].upper()} | "
-                f"${trade['amount']} x{trade['leverage']} | "
-                f"PnL: {profit_color}${trade['current_profit']:.2f} ({profit_color}{trade['profit_percent']:.1f}%) | "
-                f"Статус: {trade['profit_status']}"
-            )
+        print(f"\n🤖 Коммент нейросети: {comment}")
         
-        # Статистика закрытых сделок
-        closed_stats = market_data['closed_trades_stats']
-        closed_trades_info = (
-            f"Всего: {closed_stats['total_count']} | "
-            f"Прибыльных: {closed_stats['profitable_count']} | "
-            f"Убыточных: {closed_stats['losing_count']} | "
-            f"Общий PnL: {closed_stats['total_profit']:.2f}$"
-        )
+        orders = commands.get('orders', [])
+        if not orders:
+            action = commands.get('action')
+            if action == 'wait':
+                print(f"⏳ ОЖИДАНИЕ: {comment}")
+            else:
+                print(f"⚠️  Неизвестное действие: {action}")
+            return []
         
-        current_data = f"""
-🎯 РЕАЛЬНЫЕ ДАННЫЕ СДЕЛОК на {market_data['timestamp']}:
-
-💰 БАЛАНС КОШЕЛЬКОВ:
-{json.dumps(market_data['balance'], indent=2, ensure_ascii=False)}
-
-📊 ДОСТУПНЫЕ ИНСТРУМЕНТЫ:
-{chr(10).join(instruments_info)}
-
-💹 АКТИВНЫЕ СДЕЛКИ ({len(market_data['active_trades'])}) - РЕАЛЬНЫЙ PnL:
-{chr(10).join(active_trades_info) if active_trades_info else 'Нет активных сделок'}
-
-📈 ИСТОРИЯ ЗАКРЫТЫХ СДЕЛОК:
-{closed_trades_info}
-
-Доступный кошелек: {market_data['available_wallet']}
-
-ПРИМИ ОБОСНОВАННОЕ РЕШЕНИЕ:
-"""
+        for order in orders:
+            # Ключ привязан к снимку, по которому принято решение
+            order['key'] = order_key(order, market_data['fetched_at'])
+        reports = self.orders.execute(orders, lambda order: self.execute_order(order, market_data))
         
-        return prompt + current_data
+        if len(reports) > 1:
+            print(f"📦 Пачка из {len(reports)} ордеров:")
+        for report in reports:
+            order = report['order']
+            target = order.get('close_trade') or order.get('instrument')
+            icon = {"ok": "✅", "duplicate": "♻️ "}.get(report['outcome'], "❌")
+            print(f"   {icon} {report['action']} {target}: {report['outcome']} за {report['latency']:.2f}с"
+                  + (f" ({report['error']})" if report['error'] else ""))
+        return reports
     
-    def execute_ai_commands(self, commands, market_data):
-        """Выполнение команд от ИИ с учетом PnL"""
-        action = commands.get('action')
-        comment = commands.get('comment', '')
-        
-        print(f"\n🤖 Коммент нейросети: {comment}")
+    def execute_order(self, order, market_data):
+        """Один ордер; результат API или None"""
+        action = order['action']
         
         if action == 'open':
-            instrument = commands.get('instrument')
-            direction = commands.get('direction')
-            amount = commands.get('amount')
-            leverage = commands.get('leverage')
+            instrument = order.get('instrument')
+            direction = order.get('direction')
+            amount = order.get('amount')
+            leverage = order.get('leverage')
             
-            if all([instrument, direction, amount, leverage]):
-                instrument_exists = any(inst['symbol'] == instrument for inst in market_data['instruments'])
-                if not instrument_exists:
-                    print(f"❌ Инструмент {instrument} не найден!")
-                    return
-                
-                result = self.api.open_trade(
-                    amount=float(amount),
-                    direction=direction,
-                    instrument=instrument,
-                    leverage=int(leverage),
-                    wallet=DEFAULT_WALLET
-                )
-                
-                if result and 'trade' in result:
-                    trade = result['trade']
-                    print(f"✅ ОТКРЫТА СДЕЛКА: {instrument} {direction} ${amount} x{leverage} (ID: {trade['id']})")
-                    self.stats['total_trades'] += 1
-                else:
-                    print(f"❌ Ошибка открытия сделки")
-        
-        elif action == 'close':
-            trade_id = commands.get('close_trade')
-            if trade_id:
-                active_trade_ids = [str(trade['id']) for trade in market_data['active_trades']]
-                if trade_id not in active_trade_ids:
-                    print(f"❌ Сделка {trade_id} не найдена или не активна!")
-                    return
-                
-                # Находим сделку для отображения PnL
-                closing_trade = next((t for t in market_data['active_trades'] if str(t['id']) == trade_id), None)
-                if closing_trade:
-                    print(f"🔒 ЗАКРЫВАЕМ СДЕЛКУ: ID {trade_id}")
-                    print(f"   Инструмент: {closing_trade['instrument']}")
-                    print(f"   Направление: {closing_trade['direction']}")
-                    print(f"   Итоговый PnL: {closing_trade['current_profit']:.2f}$ ({closing_trade['profit_percent']:.1f}%)")
-                
-                result = self.api.close_trade(trade_id)
-                if result:
-                    print(f"✅ СДЕЛКА ЗАКРЫТА УСПЕШНО!")
-                else:
-                    print(f"❌ Ошибка закрытия сделки {trade_id}")
+            if not all([instrument, direction, amount, leverage]):
+                print(f"❌ Неполная команда открытия: {order}")
+                return None
+            # Снимок цикла переиспользуется, пока не истек его TTL
+            quotes = market_data['quotes']
+            if quotes.is_stale():
+                quotes = self.api.get_quotes()
+            if instrument not in quotes:
+                print(f"❌ Инструмент {instrument} не найден!")
+                return None
+            if not quotes.get(instrument).get('is_trading_open', True):
+                print(f"❌ Торговля по {instrument} сейчас закрыта!")
+                return None
+            
+            # Жесткие SL/TP ставим на стороне биржи сразу при открытии
+            rate = quotes.rate(instrument)
+            stop_loss, take_profit = (protective_prices(direction, rate, leverage,
+                                                        self.risk.stop_loss, self.risk.take_profit)
+                                      if rate else (None, None))
+            
+            result = self.api.open_trade(
+                amount=amount,
+                direction=direction,
+                instrument=instrument,
+                leverage=leverage,
+                wallet=self.wallet,
+                take_profit=take_profit,
+                stop_loss=stop_loss,
+                idempotency_key=order['key']
+            )
+            
+            if result and 'trade' in result:
+                trade = result['trade']
+                print(f"✅ ОТКРЫТА СДЕЛКА: {instrument} {direction} ${amount} x{leverage} (ID: {trade['id']})")
+                if stop_loss is not None:
+                    print(f"   SL: {stop_loss:.6g} | TP: {take_profit:.6g}")
+                self.stats['total_trades'] += 1
+                self.risk.track(trade)
+                return result
+            print(f"❌ Ошибка открытия сделки")
+            return None
         
-        elif action == 'wait':
-            print(f"⏳ ОЖИДАНИЕ: {comment}")
+        if action == 'close':
+            trade_id = order['close_trade']
+            active_trade_ids = [str(trade['id']) for trade in market_data['active_trades']]
+            # Список сделок не пришел к дедлайну - пустой список не значит, что сделки нет
+            if 'active_trades' not in market_data.get('stale', []) and trade_id not in active_trade_ids:
+                print(f"❌ Сделка {trade_id} не найдена или не активна!")
+                return None
+            
+            # Находим сделку для отображения PnL
+            closing_trade = next((t for t in market_data['active_trades'] if str(t['id']) == trade_id), None)
+            if closing_trade:
+                print(f"🔒 ЗАКРЫВАЕМ СДЕЛКУ: ID {trade_id} | {closing_trade['instrument']} "
+                      f"{closing_trade['direction']} | Итоговый PnL: {closing_trade['current_profit']:.2f}$ "
+                      f"({closing_trade['profit_percent']:.1f}%)")
+            
+            result = self.api.close_trade(trade_id, idempotency_key=order['key'])
+            if result:
+                print(f"✅ СДЕЛКА {trade_id} ЗАКРЫТА УСПЕШНО!")
+                self.risk.untrack(trade_id)
+                self.events.forget(trade_id)
+            else:
+                print(f"❌ Ошибка закрытия сделки {trade_id}")
+            return result
         
-        else:
-            print(f"⚠️  Неизвестное действие: {action}")
+        print(f"⚠️  Неизвестное действие: {action}")
+        return None
     
     def print_status(self, market_data, commands):
         """Вывод статуса в консоль с PnL"""
         print("\n" + "="*70)
-        print(f"🕒 Время: {datetime.now().strftime('%H:%M:%S')}")
+        print(f"🕒 Время: {datetime.fromtimestamp(self.clock.time()).strftime('%H:%M:%S')}")
         
         # Баланс
         balance_str = ""
@@ -242,43 +315,231 @@ class TradingBot:
             print(f"   {profit_icon} ID: {trade['id']} | {trade['instrument']} {trade['direction']} | "
                   f"PnL: {profit_sign}{trade['current_profit']:.2f}$ ({profit_sign}{trade['profit_percent']:.1f}%)")
         
+        # Время сбора данных и самый медленный запрос
+        timings = market_data.get('timings', {})
+        if timings:
+            slowest = max(timings, key=timings.get)
+            print(f"⏱  Сбор данных: {market_data['collect_time']:.2f}с "
+                  f"(самый долгий: {slowest} {timings[slowest]:.2f}с)")
+        if market_data.get('stale'):
+            print(f"⚠️  Не успели к дедлайну: {', '.join(market_data['stale'])}")
+        
         # Действие ИИ
-        action = commands.get('action', 'wait')
-        if action == 'open':
-            print(f"🎯 Действие: ОТКРЫТИЕ {commands.get('instrument')}")
-        elif action == 'close':
-            print(f"🎯 Действие: ЗАКРЫТИЕ {commands.get('close_trade')}")
-        else:
+        orders = commands.get('orders', [])
+        for order in orders:
+            if order['action'] == 'open':
+                print(f"🎯 Действие: ОТКРЫТИЕ {order.get('instrument')}")
+            elif order['action'] == 'close':
+                print(f"🎯 Действие: ЗАКРЫТИЕ {order.get('close_trade')}")
+        if not orders:
             print(f"🎯 Действие: ОЖИДАНИЕ")
         
         print("="*70)
     
+    def stop(self):
+        print("\n🛑 Остановка бота...")
+        self.risk.stop()
+        metrics.stop()
+        # Дописать котировки, которые еще в очереди фоновой записи
+        writer = getattr(self.api, 'quote_writer', None)
+        if writer is not None:
+            writer.stop()
+    
     def run(self):
-        """Основной цикл работы"""
+        """Основной цикл: ИИ по событиям рынка (EVENT_DRIVEN) или с фиксированным шагом UPDATE_INTERVAL"""
         print("🚀 Запуск AI Трейдера...")
         print("📊 Теперь ИИ видит прибыль/убыток по сделкам!")
         
+        # SL/TP проверяются каждую секунду в отдельном потоке, не дожидаясь ИИ
+        self.risk.start()
+        metrics.start_log(self.metrics_log)
+        if self.metrics_port:
+            metrics.serve(self.metrics_port)
+            print(f"📈 Метрики: http://127.0.0.1:{self.metrics_port}/metrics")
+        next_tick = self.clock.time()
+        
         while True:
             try:
-                market_data = self.get_market_data()
-                prompt = self.format_ai_prompt(market_data)
-                
-                ai_response = self.ai.call_ai([{"role": "user", "content": prompt}])
-                print(f"🧠 Ответ ИИ: {ai_response}")
-                
-                commands = self.ai.parse_ai_response(ai_response)
-                self.print_status(market_data, commands)
-                self.execute_ai_commands(commands, market_data)
-                
-                print(f"\n⏰ Ожидание {UPDATE_INTERVAL} секунд...")
-                time.sleep(UPDATE_INTERVAL)
-                
+                latest, _ = self.run_cycle()
+                # Точка отсчета для триггеров - состояние, по которому ИИ только что решал
+                self.events.arm(latest)
             except KeyboardInterrupt:
-                print("\n🛑 Остановка бота...")
+                self.stop()
                 break
             except Exception as e:
                 print(f"❌ Ошибка в основном цикле: {e}")
-                time.sleep(UPDATE_INTERVAL)
+            
+            if self.event_driven:
+                try:
+                    self.wait_for_event()
+                except KeyboardInterrupt:
+                    self.stop()
+                    break
+                continue
+            
+            # Следующий цикл по расписанию, а не через UPDATE_INTERVAL после конца текущего
+            next_tick += UPDATE_INTERVAL
+            delay = next_tick - self.clock.time()
+            self.stats['cycle_lag'] = max(0.0, -delay)
+            metrics.set_gauge('cycle_lag_seconds', self.stats['cycle_lag'])
+            if delay < 0:
+                print(f"🐢 Отставание от расписания: {-delay:.1f}с")
+                # Пропущенные такты не догоняем пачкой
+                next_tick = self.clock.time()
+                continue
+            
+            print(f"\n⏰ Ожидание {delay:.1f} секунд...")
+            try:
+                self.clock.sleep(delay)
+            except KeyboardInterrupt:
+                self.stop()
+                break
+    
+    def wait_for_event(self):
+        """Дешевые проверки котировок до первого триггера (не раньше EVENT_MIN_INTERVAL) или до EVENT_MAX_IDLE"""
+        last_cycle = self.clock.time()
+        triggers = []
+        first_at = None
+        print(f"\n👀 Жду событий рынка (не дольше {EVENT_MAX_IDLE}с)...")
+        while True:
+            self.clock.sleep(EVENT_POLL_INTERVAL)
+            try:
+                fired = self.events.check(max_age=EVENT_POLL_INTERVAL)
+            except Exception as e:
+                print(f"❌ Ошибка проверки событий: {e}")
+                fired = []
+            if fired and first_at is None:
+                first_at = self.clock.time()
+            triggers.extend(fired)
+            
+            idle = self.clock.time() - last_cycle
+            if triggers and idle >= EVENT_MIN_INTERVAL:
+                break
+            if idle >= EVENT_MAX_IDLE:
+                triggers = [('heartbeat', f"нет событий {idle:.0f}с")]
+                break
+        
+        for kind, text in triggers:
+            metrics.inc('ai_triggers_total', kind=kind)
+            print(f"⚡ Триггер: {text}")
+        if first_at is not None:
+            # Задержка реакции: от обнаружения события до запуска цикла ИИ
+            metrics.observe('event_reaction_seconds', self.clock.time() - first_at)
+        self.triggers = triggers
+    
+    def next_market_data(self):
+        """Снимок для цикла: предзагруженный во время прошлого вызова ИИ, если еще свежий"""
+        prefetched, self.prefetched = self.prefetched, None
+        if prefetched and self.clock.time() - prefetched['fetched_at'] <= PREFETCH_MAX_AGE:
+            return prefetched
+        return self.get_market_data()
+    
+    def call_ai_pipelined(self, messages, market_data):
+        """Вызов ИИ в фоне; к его ожидаемому концу один раз обновляем снимок рынка. Возвращает (ответ, свежий снимок)"""
+        future = self.ai_pool.submit(self.ai.call_ai, messages)
+        # Сбор стартует так, чтобы закончиться к p95 провайдера; без статистики - через PREFETCH_INTERVAL
+        expected = self.ai.expected_latency()
+        delay = PREFETCH_INTERVAL if expected is None else max(0.0, expected - self.prefetch_seconds)
+        try:
+            return future.result(timeout=delay), market_data
+        except FuturesTimeout:
+            pass
+        latest = market_data
+        started = time.time()
+        try:
+            latest = self.get_market_data()
+            self.prefetched = latest
+        except Exception as e:
+            print(f"❌ Ошибка предзагрузки данных: {e}")
+        self.prefetch_seconds = time.time() - started
+        return future.result(), latest
+    
+    def revalidate(self, order, decided_on, latest):
+        """Проверить ордер по свежему снимку перед исполнением; текст причины отказа или None"""
+        if latest is decided_on:
+            return None
+        action = order['action']
+        if action == 'close':
+            # Свежий снимок без списка сделок не опровергает решение - сверяем с тем, по которому решали
+            source = decided_on if 'active_trades' in latest.get('stale', []) else latest
+            if 'active_trades' in source.get('stale', []):
+                return None
+            active_ids = {str(t['id']) for t in source['active_trades']}
+            if order['close_trade'] not in active_ids:
+                return f"сделка {order['close_trade']} уже не активна"
+        elif action == 'open':
+            instrument = order.get('instrument')
+            old_rate = decided_on['quotes'].rate(instrument)
+            new_rate = latest['quotes'].rate(instrument)
+            if old_rate and new_rate:
+                moved = abs(new_rate / old_rate - 1) * 100
+                if moved > PRICE_TOLERANCE:
+                    return f"цена {instrument} ушла на {moved:.2f}% пока думал ИИ"
+        return None
+    
+    def run_cycle(self):
+        """Один цикл: данные -> ИИ -> исполнение"""
+        cycle_started = time.time()
+        stages = {}
+        
+        @contextmanager
+        def stage(name):
+            # Время этапа - в гистограмму и в JSON-событие цикла
+            started = time.time()
+            try:
+                with metrics.timer('stage_seconds', stage=name):
+                    yield
+            finally:
+                stages[name] = time.time() - started
+        
+        with stage("collect"):
+            market_data = self.next_market_data()
+        # Почему проснулся ИИ - подсказка модели, на что смотреть
+        market_data['triggers'] = [text for _, text in self.triggers]
+        self.triggers = []
+        with stage("prompt"):
+            messages = self.prompts.build(market_data)
+        latest = market_data
+        
+        # На спокойном рынке с тем же состоянием переиспользуем недавнее решение
+        state = self.decisions.fingerprint(market_data)
+        ai_response = self.decisions.get(state)
+        cached = ai_response is not None
+        metrics.inc('decision_cache_total', result="hit" if cached else "miss")
+        if ai_response is None:
+            with stage("ai"):
+                ai_response, latest = self.call_ai_pipelined(messages, market_data)
+            # Кэш и история диалога - только для полных ответов, оборванный повторять нельзя
+            if self.ai.is_complete(ai_response):
+                self.decisions.put(state, ai_response)
+                self.prompts.record_response(ai_response)
+            print(f"🧠 Ответ ИИ: {ai_response}")
+        else:
+            print(f"♻️  Решение из кэша (попаданий {self.decisions.hits}, "
+                  f"промахов {self.decisions.misses}): {ai_response}")
+        
+        with stage("parse"):
+            commands = self.ai.parse_ai_response(ai_response)
+        self.print_status(market_data, commands)
+        
+        # Устаревшие ордера отбрасываем по одному, остальные пачки исполняются
+        rejected = []
+        for order in list(commands['orders']):
+            reason = self.revalidate(order, market_data, latest)
+            if reason:
+                print(f"🚫 Ордер отменен: {reason}")
+                rejected.append(reason)
+                commands['orders'].remove(order)
+        if not (rejected and not commands['orders']):
+            with stage("execute"):
+                self.execute_ai_commands(commands, latest)
+        
+        cycle_time = time.time() - cycle_started
+        metrics.observe('cycle_seconds', cycle_time)
+        metrics.event('cycle', action=commands.get('action'), cached=cached, rejected=rejected,
+                      stages=stages, timings=market_data.get('timings', {}),
+                      stale=market_data.get('stale', []), cycle_time=cycle_time)
+        return latest, commands
 
 if __name__ == "__main__":
     bot = TradingBot()
@@ -0,0 +1,158 @@
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import METRICS_LOG_PATH, METRICS_LOG_BYTES, METRICS_LOG_BACKUPS
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """Счетчики, гистограммы и gauge в памяти + JSON-лог событий в отдельном потоке"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.log = None
+        self.listener = None
+        self.server = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Замер блока в гистограмму name с меткой outcome=ok|error"""
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, outcome=outcome, **labels)
+
+    def event(self, kind, **fields):
+        """Запись в JSON-лог; сериализация и запись на диск - в потоке QueueListener"""
+        if self.log is not None:
+            self.log.info(dict(fields, type=kind, ts=time.time()))
+
+    def start_log(self, path=METRICS_LOG_PATH):
+        handler = RotatingFileHandler(path, maxBytes=METRICS_LOG_BYTES, backupCount=METRICS_LOG_BACKUPS,
+                                      encoding='utf-8')
+        handler.setFormatter(_JsonFormatter())
+        events = queue.Queue()
+        self.listener = QueueListener(events, handler)
+        self.listener.start()
+        self.log = logging.getLogger("tontrader.metrics")
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+        self.log.addHandler(_RawQueueHandler(events))
+
+    def render(self):
+        """Текст в формате Prometheus exposition"""
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: dict(v, buckets=list(v['buckets'])) for k, v in self.histograms.items()}
+
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({n for n, _ in series}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (n, key), value in series.items():
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for name in sorted({n for n, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, key), hist in histograms.items():
+                if n != name:
+                    continue
+                for bound, count in zip(BUCKETS, hist['buckets']):
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', bound))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {hist['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {hist['sum']}")
+                lines.append(f"{name}_count{_format_labels(key)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Локальный HTTP-эндпоинт /metrics в фоновом потоке"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        return self.server
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+        if self.listener is not None:
+            self.listener.stop()
+
+
+class _RawQueueHandler(QueueHandler):
+    # Запись уходит в очередь как есть - форматирование уже в потоке слушателя
+    def prepare(self, record):
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+# Общий реестр процесса
+metrics = Metrics()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from config import DEFAULT_WALLET
+
+DEFAULT_AI_RESPONSE = "<действие=wait>\n<comment>Тестовый ответ: рынок без сигналов, жду.</comment>"
+# Размер куска потокового ответа ИИ, символов
+AI_CHUNK = 8
+
+
+def price_at(symbol, t):
+    """Детерминированная цена символа в момент t: повторные запросы истории согласованы между собой"""
+    seed = zlib.crc32(symbol.encode('utf-8'))
+    base = 1 + seed % 50000
+    phase = (seed % 628) / 100
+    minutes = t / 60
+    return base * (1 + 0.02 * math.sin(minutes / 37 + phase) + 0.005 * math.sin(minutes / 5 + 2 * phase))
+
+
+class MockMarket:
+    """Состояние биржи-заглушки: N инструментов, M открытых позиций, закрытые сделки"""
+
+    def __init__(self, instruments=10, positions=10, closed=20, seed=1):
+        self.symbols = [f"T{i:04d}USDT" for i in range(instruments)]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.active = {}
+        self.closed = []
+        self.balance = 1_000_000.0
+        now = time.time()
+        for i in range(positions):
+            self.open(self.symbols[i % len(self.symbols)], "buy" if i % 2 == 0 else "sell",
+                      10, 10, now - 600)
+        for i in range(closed):
+            trade = self.open(self.symbols[i % len(self.symbols)], "buy", 10, 10, now - 7200)
+            self.close(trade['id'], now - 3600 + i)
+
+    def quote(self, symbol, now):
+        rate = price_at(symbol, now)
+        return {
+            'symbol': symbol,
+            'alias': symbol,
+            'rate': f"{rate:.6f}",
+            'ask': f"{rate * 1.0005:.6f}",
+            'bid': f"{rate * 0.9995:.6f}",
+            'profit_day_pl_percent': f"{(rate / price_at(symbol, now - 86400) - 1) * 100:.2f}",
+            'is_trading_open': True,
+        }
+
+    def instruments(self):
+        now = time.time()
+        return {'instruments': [self.quote(s, now) for s in self.symbols]}
+
+    def history(self, symbol, count):
+        if symbol not in self.symbols:
+            return None
+        last = int(time.time() // 60 * 60)
+        bars = []
+        for t in range(last - 60 * (count - 1), last + 1, 60):
+            o, c = price_at(symbol, t), price_at(symbol, t + 59)
+            bars.append({'t': t * 1000, 'o': f"{o:.6f}", 'c': f"{c:.6f}",
+                         'h': f"{max(o, c) * 1.001:.6f}", 'l': f"{min(o, c) * 0.999:.6f}", 'v': "100"})
+        return {'history': bars}
+
+    def open(self, instrument, direction, amount, leverage, opened_at=None, **extra):
+        with self.lock:
+            trade = {
+                'id': self.next_id,
+                'instrument': instrument,
+                'direction': direction,
+                'amount': amount,
+                'leverage': leverage,
+                'wallet': extra.get('wallet', DEFAULT_WALLET),
+                'open_rate': f"{price_at(instrument, opened_at or time.time()):.6f}",
+                'opened_at': int((opened_at or time.time()) * 1000),
+                'status': 'active',
+                'commission': -amount * leverage * 0.0005,
+                'take_profit_price': extra.get('take_profit_price'),
+                'stop_loss_price': extra.get('stop_loss_price'),
+            }
+            self.next_id += 1
+            self.active[trade['id']] = trade
+            self.balance -= amount
+            return trade
+
+    def close(self, trade_id, closed_at=None):
+        closed_at = closed_at or time.time()
+        with self.lock:
+            trade = self.active.pop(trade_id, None)
+            if trade is None:
+                return None
+            rate = price_at(trade['instrument'], closed_at)
+            move = rate / float(trade['open_rate']) - 1
+            sign = 1 if trade['direction'] == 'buy' else -1
+            profit = sign * move * trade['amount'] * trade['leverage'] + trade['commission']
+            trade.update(status='closed', close_rate=f"{rate:.6f}", profit=round(profit, 4),
+                         closed_at=int(closed_at * 1000))
+            self.closed.append(trade)
+            self.balance += trade['amount'] + profit
+            return trade
+
+
+class MockTradingServer:
+    """Локальная замена торгового API и OpenAI-совместимого ИИ с задержками и ошибками"""
+
+    def __init__(self, instruments=10, positions=10, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, ai_latency=0.0, ai_token_delay=0.0, ai_response=DEFAULT_AI_RESPONSE,
+                 host="127.0.0.1", port=0, seed=1):
+        self.market = MockMarket(instruments, positions, seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.ai_latency = ai_latency
+        self.ai_token_delay = ai_token_delay
+        self.ai_response = ai_response
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    @property
+    def ai_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'errors': 0, 'endpoints': {}}
+
+    def count(self, endpoint, bytes_in, bytes_out, error=False):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+            self.stats['errors'] += int(error)
+            self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, endpoints=dict(self.stats['endpoints']))
+
+    def delay(self):
+        with self.lock:
+            pause = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if pause > 0:
+            time.sleep(pause)
+
+    def injected_error(self):
+        """Код ошибки для этого запроса или None"""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def route(self, method, path, query, body):
+        """(эндпоинт, код, тело ответа) торгового API"""
+        market = self.market
+        parts = path.removeprefix("/api/v1").strip("/").split("/")
+        if method == "GET" and parts == ["users", "session"]:
+            return "session", 200, {'balance': [{'wallet': DEFAULT_WALLET, 'amount': round(market.balance, 2)}],
+                                    'miner': {}}
+        if method == "GET" and parts == ["instruments"]:
+            return "instruments", 200, market.instruments()
+        if method == "GET" and parts[:2] == ["instruments", "history"] and len(parts) == 4:
+            count = int(query.get('count', ['30'])[0])
+            history = market.history(parts[2], count)
+            return "history", (200 if history else 404), history or {'error': 'unknown symbol'}
+        if method == "GET" and parts[:2] == ["trades", "closed"]:
+            lo = int(query.get('from', ['0'])[0])
+            hi = int(query.get('to', [str(2 ** 62)])[0])
+            with market.lock:
+                trades = [t for t in market.closed if lo <= t['closed_at'] <= hi]
+            return "closed_trades", 200, {'trades': trades}
+        if method == "GET" and parts == ["trades", "active"]:
+            with market.lock:
+                return "active_trades", 200, {'trades': list(market.active.values())}
+        if method == "GET" and parts[0] == "trades" and len(parts) == 2:
+            with market.lock:
+                trade = market.active.get(int(parts[1])) if parts[1].isdigit() else None
+            return "trade_status", (200 if trade else 404), {'trade': trade} if trade else {'error': 'not found'}
+        if method == "POST" and parts == ["trades"]:
+            trade = market.open(body['instrument'], body['direction'], float(body['amount']),
+                                int(body['leverage']), wallet=body.get('wallet'),
+                                take_profit_price=body.get('take_profit_price'),
+                                stop_loss_price=body.get('stop_loss_price'))
+            return "open_trade", 200, {'trade': trade}
+        if method == "POST" and parts[0] == "trades" and len(parts) == 3 and parts[2] == "close":
+            trade = market.close(int(parts[1])) if parts[1].isdigit() else None
+            return "close_trade", (200 if trade else 404), {'trade': trade} if trade else {'error': 'not active'}
+        return "unknown", 404, {'error': 'not found'}
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, как у настоящего API - иначе бенчмарк мерил бы установку соединений
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело уходят разными write: с Nagle и delayed ACK каждый запрос
+            # на переиспользуемом соединении ждал бы ~40 мс
+            disable_nagle_algorithm = True
+
+            def read_body(self):
+                raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                return raw, (json.loads(raw) if raw else {})
+
+            def send_json(self, status, payload, extra_headers=()):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in extra_headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                return len(data)
+
+            def handle_request(self, method):
+                url = urlsplit(self.path)
+                raw, body = self.read_body()
+                server.delay()
+                if url.path.startswith("/v1/chat/completions"):
+                    self.chat(body, len(raw))
+                    return
+                error = server.injected_error()
+                if error:
+                    headers = [("Retry-After", "1")] if error == 429 else []
+                    sent = self.send_json(error, {'error': 'injected'}, headers)
+                    server.count("error", len(raw), sent, error=True)
+                    return
+                endpoint, status, payload = server.route(method, url.path, parse_qs(url.query), body)
+                sent = self.send_json(status, payload)
+                server.count(endpoint, len(raw), sent)
+
+            def chat(self, body, bytes_in):
+                """Заглушка OpenAI chat.completions: обычный ответ или SSE-поток кусками"""
+                if server.ai_latency:
+                    time.sleep(server.ai_latency)
+                text = server.ai_response
+                base = {'id': 'mock', 'created': int(time.time()), 'model': body.get('model', 'mock')}
+                if not body.get('stream'):
+                    sent = self.send_json(200, dict(base, object='chat.completion', choices=[
+                        {'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}
+                    ], usage={'prompt_tokens': 0, 'completion_tokens': len(text) // 3,
+                              'total_tokens': len(text) // 3}))
+                    server.count("ai", bytes_in, sent)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                sent = 0
+                try:
+                    for i in range(0, len(text), AI_CHUNK):
+                        chunk = dict(base, object='chat.completion.chunk', choices=[
+                            {'index': 0, 'delta': {'content': text[i:i + AI_CHUNK]}, 'finish_reason': None}
+                        ])
+                        data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+                        self.wfile.write(data)
+                        self.wfile.flush()
+                        sent += len(data)
+                        if server.ai_token_delay:
+                            time.sleep(server.ai_token_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент прервал поток, получив полную команду
+                server.count("ai", bytes_in, sent)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mockserver", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная заглушка торгового API и ИИ")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--instruments", type=int, default=10)
+    parser.add_argument("--positions", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="секунд на запрос")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± секунд к задержке")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--ai-latency", type=float, default=0.0, help="секунд до первого токена ИИ")
+    args = parser.parse_args()
+
+    server = MockTradingServer(args.instruments, args.positions, args.latency, args.jitter, args.error_rate,
+                               args.throttle_rate, args.ai_latency, port=args.port)
+    print(f"🧪 Торговый API: {server.url}")
+    print(f"🧪 ИИ (OpenAI-совместимый): {server.ai_url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
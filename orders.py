@@ -0,0 +1,85 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import ORDER_CONCURRENCY, ORDER_DEDUP_TTL
+from metrics import metrics
+
+
+def order_key(order, salt=""):
+    """Клиентский ключ идемпотентности ордера.
+
+    Закрытие сделки - всегда одно и то же намерение, ключ по id сделки.
+    Открытие - по параметрам и решению (salt), чтобы повтор того же решения не открыл вторую позицию.
+    """
+    if order['action'] == 'close':
+        return f"close:{order['close_trade']}"
+    raw = "|".join(str(order.get(k)) for k in ('instrument', 'direction', 'amount', 'leverage'))
+    return f"open:{hashlib.sha1(f'{salt}|{raw}'.encode('utf-8')).hexdigest()[:16]}"
+
+
+class InFlightRegistry:
+    """Ордера в полете и недавно исполненные - общий для ИИ и риск-монитора"""
+
+    def __init__(self, ttl=ORDER_DEDUP_TTL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.in_flight = set()
+        self.completed = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key):
+        """Занять ключ; False, если такой ордер уже исполняется или только что исполнен"""
+        with self.lock:
+            now = self.clock()
+            self.completed = {k: t for k, t in self.completed.items() if now - t <= self.ttl}
+            if key in self.in_flight or key in self.completed:
+                return False
+            self.in_flight.add(key)
+            return True
+
+    def finish(self, key, ok):
+        """Освободить ключ; успешный ордер помнится ttl секунд"""
+        with self.lock:
+            self.in_flight.discard(key)
+            if ok:
+                self.completed[key] = self.clock()
+
+
+class OrderExecutor:
+    """Параллельная отправка пачки ордеров с дедупликацией и замером каждого"""
+
+    def __init__(self, registry=None, max_workers=ORDER_CONCURRENCY):
+        self.registry = registry or InFlightRegistry()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orders")
+
+    def execute(self, orders, handler):
+        """Исполнить ордера через handler(order) -> результат API или None; отчеты в порядке ордеров"""
+        futures = [self.pool.submit(self.run_one, order, handler) for order in orders]
+        return [future.result() for future in futures]
+
+    def run_one(self, order, handler):
+        key = order['key']
+        report = {'key': key, 'action': order['action'], 'order': order,
+                  'outcome': None, 'latency': 0.0, 'result': None, 'error': None}
+        if not self.registry.claim(key):
+            report['outcome'] = "duplicate"
+            metrics.inc('orders_total', action=order['action'], outcome="duplicate")
+            return report
+
+        started = time.time()
+        try:
+            report['result'] = handler(order)
+            report['outcome'] = "ok" if report['result'] else "error"
+        except Exception as e:
+            report['outcome'] = "error"
+            report['error'] = str(e)
+        finally:
+            report['latency'] = time.time() - started
+            self.registry.finish(key, report['outcome'] == "ok")
+        metrics.observe('order_seconds', report['latency'], action=order['action'], outcome=report['outcome'])
+        metrics.inc('orders_total', action=order['action'], outcome=report['outcome'])
+        return report
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,194 @@
+import os
+from config import (PROMPT_PATH, PROMPT_TOKEN_BUDGET, PROMPT_CONTEXT_BUDGET,
+                    PROMPT_HISTORY_BARS, PROMPT_DELTA, EMA_FAST, EMA_SLOW, RETURN_WINDOWS)
+
+try:
+    import tiktoken  # точный подсчет токенов - опционально
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+TREND_ARROWS = {"📈 ВОСХОДЯЩИЙ": "↑", "📉 НИСХОДЯЩИЙ": "↓", "➡️ БОКОВОЙ": "→"}
+
+INSTRUMENT_HEADER = (f"symbol|rate|ask|bid|day%|trend|str%|ema{EMA_FAST}|ema{EMA_SLOW}|"
+                     f"rsi|atr%|vol%|vwap|sup|res|" + "|".join(f"r{k}m%" for k in RETURN_WINDOWS))
+TRADE_HEADER = "id|symbol|dir|amount|lev|open|pnl$|pnl%"
+
+
+def count_tokens(text):
+    """Число токенов; без tiktoken - грубая оценка с запасом для кириллицы и цифр"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 3 + 1
+
+
+def fmt(value, spec=".6g"):
+    if value is None or value == '':
+        return "-"
+    try:
+        return f"{float(value):{spec}}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def instrument_row(inst):
+    ind = inst.get('indicators') or {}
+    returns = ind.get('returns', {})
+    flags = ("" if inst.get('is_trading_open', True) else " closed") + (" stale" if inst.get('stale') else "")
+    return "|".join([
+        inst['symbol'], fmt(inst['current_rate']), fmt(inst['ask']), fmt(inst['bid']),
+        fmt(inst.get('change_percent'), ".2f"), TREND_ARROWS.get(inst.get('trend'), "-"),
+        fmt(inst.get('trend_strength'), ".2f"), fmt(ind.get('ema_fast')), fmt(ind.get('ema_slow')),
+        fmt(ind.get('rsi'), ".0f"), fmt(ind.get('atr_percent'), ".2f"), fmt(ind.get('volatility'), ".3f"),
+        fmt(ind.get('vwap')), fmt(ind.get('support')), fmt(ind.get('resistance')),
+        *(fmt(returns.get(k), "+.2f") for k in RETURN_WINDOWS),
+    ]) + flags
+
+
+def trade_row(trade):
+    return "|".join([
+        str(trade['id']), trade['instrument'], trade['direction'], fmt(trade['amount']),
+        str(trade['leverage']), fmt(trade['open_rate']),
+        fmt(trade['current_profit'], "+.2f"), fmt(trade['profit_percent'], "+.1f"),
+    ])
+
+
+def history_row(symbol, bars, count=PROMPT_HISTORY_BARS):
+    return f"{symbol}: " + " ".join(fmt(bar['c'], ".6g") for bar in bars[-count:])
+
+
+class PromptBuilder:
+    """Промпт ИИ: статичный системный префикс в памяти + компактные, по возможности дельта-, данные"""
+
+    def __init__(self, path=PROMPT_PATH, token_budget=PROMPT_TOKEN_BUDGET,
+                 context_budget=PROMPT_CONTEXT_BUDGET, delta=PROMPT_DELTA):
+        self.path = path
+        self.token_budget = token_budget
+        self.context_budget = context_budget
+        self.delta = delta
+        self.system_prompt = None
+        self.mtime = None
+        self.turns = []
+        self.turn_tokens = 0
+        self.sent_rows = {}
+        self.pending = None
+
+    def get_system_prompt(self):
+        """Инструкции из prompt.txt; перечитываются только при изменении файла"""
+        mtime = os.path.getmtime(self.path)
+        if mtime != self.mtime:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.system_prompt = f.read()
+            if self.mtime is not None:
+                # Инструкции поменялись - старая переписка им больше не соответствует
+                self.reset()
+            self.mtime = mtime
+        return self.system_prompt
+
+    def reset(self):
+        self.turns = []
+        self.turn_tokens = 0
+        self.sent_rows = {}
+
+    def snapshot_rows(self, market_data):
+        """Строки данных, по которым считается дельта"""
+        rows = {}
+        balance = " ".join(f"{b['wallet']}={fmt(b['amount'], '.2f')}" for b in market_data['balance'])
+        rows['balance'] = balance or "-"
+        closed = market_data['closed_trades_stats']
+        rows['closed'] = (f"всего {closed['total_count']}, прибыльных {closed['profitable_count']}, "
+                          f"убыточных {closed['losing_count']}, PnL {closed['total_profit']:.2f}$")
+        for inst in market_data['instruments']:
+            rows[('inst', inst['symbol'])] = instrument_row(inst)
+        for symbol, bars in market_data.get('price_history', {}).items():
+            if bars:
+                rows[('hist', symbol)] = history_row(symbol, bars)
+        return rows
+
+    def build(self, market_data):
+        """Сообщения для ИИ на этот цикл"""
+        system_prompt = self.get_system_prompt()
+        rows = self.snapshot_rows(market_data)
+        full = not (self.delta and self.turns)
+        changed = rows if full else {k: v for k, v in rows.items() if self.sent_rows.get(k) != v}
+
+        lines = [f"{'ДАННЫЕ' if full else 'ИЗМЕНЕНИЯ С ПРОШЛОГО ЦИКЛА'} на {market_data['timestamp']}"]
+        if market_data.get('triggers'):
+            lines.append("Повод для решения: " + "; ".join(market_data['triggers']))
+        if 'balance' in changed:
+            lines.append(f"Баланс: {changed['balance']}")
+        lines.append(f"Кошелек для сделок: {market_data['available_wallet']}")
+
+        # Позиции критичны для решения - всегда полностью
+        lines.append(f"Активные сделки ({len(market_data['active_trades'])}):")
+        if market_data['active_trades']:
+            lines.append(TRADE_HEADER)
+            lines.extend(trade_row(t) for t in market_data['active_trades'])
+        elif 'active_trades' in market_data.get('stale', []):
+            lines.append("данные по сделкам не получены (таймаут) - не принимай решений по ним")
+        else:
+            lines.append("нет")
+        if 'closed' in changed:
+            lines.append(f"Закрытые сделки: {changed['closed']}")
+
+        # Сначала символы открытых позиций, затем остальные - пока хватает бюджета
+        held = {t['instrument'] for t in market_data['active_trades']}
+        symbols = sorted((inst['symbol'] for inst in market_data['instruments']),
+                         key=lambda s: s not in held)
+        tokens = count_tokens("\n".join(lines))
+        dropped = 0
+        # Что модель реально увидит; опущенные по бюджету строки уйдут в следующей дельте
+        sent = {} if full else dict(self.sent_rows)
+        sent.update({k: changed[k] for k in ('balance', 'closed') if k in changed})
+        for kind, title, header in (('inst', "Инструменты:", INSTRUMENT_HEADER),
+                                    ('hist', f"Закрытия последних {PROMPT_HISTORY_BARS} m1-свечей:", None)):
+            if not any((kind, s) in changed for s in symbols):
+                continue
+            block = [title] + ([header] if header else [])
+            tokens += count_tokens("\n".join(block))
+            for symbol in [s for s in symbols if (kind, s) in changed]:
+                row = rows[(kind, symbol)]
+                row_tokens = count_tokens(row)
+                if tokens + row_tokens > self.token_budget:
+                    dropped += 1
+                    continue
+                block.append(row)
+                sent[(kind, symbol)] = row
+                tokens += row_tokens
+            lines.extend(block)
+        if dropped:
+            lines.append(f"(еще {dropped} строк опущено по лимиту токенов)")
+        if not full:
+            # Иначе модель считала бы выбывший инструмент актуальным по старым строкам переписки
+            removed = sorted(k[1] for k in self.sent_rows if isinstance(k, tuple) and k[0] == 'inst' and k not in rows)
+            if removed:
+                lines.append("Выбыли из подборки, данных по ним больше нет: " + ", ".join(removed))
+            sent = {k: v for k, v in sent.items() if not isinstance(k, tuple) or k in rows}
+            unchanged = len([k for k in rows if k not in changed])
+            lines.append(f"Без изменений: {unchanged} строк")
+        lines.append("ПРИМИ ОБОСНОВАННОЕ РЕШЕНИЕ:")
+
+        content = "\n".join(lines)
+        self.pending = (content, sent, full)
+
+        messages = [{"role": "system", "content": system_prompt}]
+        for user, assistant in ([] if full else self.turns):
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": assistant})
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def record_response(self, response):
+        """Зафиксировать ход переписки после ответа ИИ (база для следующей дельты)"""
+        if self.pending is None:
+            return
+        content, sent, full = self.pending
+        self.pending = None
+        if full:
+            self.reset()
+        self.turns.append((content, response))
+        self.turn_tokens += count_tokens(content) + count_tokens(response)
+        self.sent_rows = sent
+        if not self.delta or self.turn_tokens > self.context_budget:
+            # Переписка разрослась - следующий цикл начнется с полного снимка
+            self.reset()
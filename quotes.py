@@ -0,0 +1,40 @@
+import time
+from config import QUOTES_TTL
+
+class QuoteSnapshot:
+    """Снимок котировок всех инструментов, полученный одним запросом"""
+
+    def __init__(self, instruments, fetched_at=None):
+        self.instruments = instruments
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        # Индекс по символу вместо линейного поиска по списку
+        self.by_symbol = {inst['symbol']: inst for inst in instruments}
+
+    def __contains__(self, symbol):
+        return symbol in self.by_symbol
+
+    def __len__(self):
+        return len(self.by_symbol)
+
+    def get(self, symbol):
+        """Данные инструмента или None"""
+        return self.by_symbol.get(symbol)
+
+    def rate(self, symbol):
+        """Текущая цена инструмента или None, если цены нет или она не положительная"""
+        inst = self.by_symbol.get(symbol)
+        if not inst:
+            return None
+        try:
+            rate = float(inst.get('rate'))
+        except (TypeError, ValueError):
+            return None
+        return rate if rate > 0 else None
+
+    def age(self):
+        """Возраст снимка в секундах"""
+        return time.time() - self.fetched_at
+
+    def is_stale(self, ttl=QUOTES_TTL):
+        """Снимок старше допустимого TTL"""
+        return self.age() > ttl
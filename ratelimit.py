@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from config import RATE_LIMITS, RATE_LIMIT_GLOBAL, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from metrics import metrics
+
+# Полосы приоритета: меньше - раньше
+PRIORITY_ORDERS = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+# Эндпоинт -> (семейство лимита, приоритет)
+ENDPOINTS = {
+    'open_trade': ('orders', PRIORITY_ORDERS),
+    'close_trade': ('orders', PRIORITY_ORDERS),
+    'active_trades': ('trades', PRIORITY_NORMAL),
+    'trades': ('trades', PRIORITY_NORMAL),
+    'trade_status': ('trades', PRIORITY_NORMAL),
+    'closed_trades': ('trades', PRIORITY_BACKGROUND),
+    'session': ('session', PRIORITY_NORMAL),
+    'instruments': ('market', PRIORITY_NORMAL),
+    'history': ('market', PRIORITY_BACKGROUND),
+}
+
+# Ответы, после которых запрос стоит повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Ответы «слишком часто» - притормаживаем все семейство, а не один запрос
+THROTTLE_STATUSES = {429, 503}
+# Ниже этой доли лимита скорость при троттлинге не опускаем
+MIN_RATE_FRACTION = 0.1
+# Шаг восстановления скорости после успешного ответа, доля лимита
+RECOVER_FRACTION = 0.05
+
+
+class RateLimitTimeout(Exception):
+    """Слот под запрос не освободился до таймаута"""
+
+
+def parse_retry_after(value):
+    """Секунды из заголовка Retry-After (число или HTTP-дата); None, если заголовка нет"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), RETRY_MAX_DELAY)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Экспоненциальная пауза с полным джиттером, но не меньше Retry-After"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+class TokenBucket:
+    """Ведро токенов с адаптивной скоростью: вдвое медленнее на 429, плавный возврат к лимиту"""
+
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Сколько ждать до свободного токена"""
+        self.refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def throttle(self, now, pause):
+        self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + pause)
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVER_FRACTION)
+
+
+class RequestScheduler:
+    """Единая очередь запросов к платформе: лимиты по семействам, общий лимит и полосы приоритета"""
+
+    def __init__(self, limits=RATE_LIMITS, global_limit=RATE_LIMIT_GLOBAL, endpoints=ENDPOINTS):
+        self.buckets = {family: TokenBucket(*limit) for family, limit in limits.items()}
+        self.global_bucket = TokenBucket(*global_limit) if global_limit else None
+        self.endpoints = endpoints
+        self.cond = threading.Condition()
+        self.waiters = []
+        self.seq = itertools.count()
+
+    def route(self, endpoint):
+        """Семейство и приоритет эндпоинта; незнакомые идут обычной полосой без лимита семейства"""
+        return self.endpoints.get(endpoint, (None, PRIORITY_NORMAL))
+
+    def _wait_time(self, family, now):
+        waits = [bucket.wait_time(now) for bucket in (self.buckets.get(family), self.global_bucket) if bucket]
+        return max(waits, default=0.0)
+
+    def _blocked_by(self, entry, now):
+        """Есть ли впереди более приоритетный запрос, который может уйти прямо сейчас"""
+        for other in sorted(self.waiters):
+            if other is entry:
+                return False
+            bucket = self.buckets.get(other[2])
+            # Приоритетный запрос, упершийся в лимит своего семейства, не держит остальных
+            if bucket is None or bucket.wait_time(now) == 0:
+                return True
+        return False
+
+    def acquire(self, endpoint, timeout=None):
+        """Дождаться слота под запрос; возвращает время ожидания"""
+        family, priority = self.route(endpoint)
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        entry = (priority, next(self.seq), family)
+        with self.cond:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(family, now)
+                    blocked = self._blocked_by(entry, now)
+                    if wait == 0 and not blocked:
+                        for bucket in (self.buckets.get(family), self.global_bucket):
+                            if bucket:
+                                bucket.take()
+                        break
+                    if deadline is not None and now >= deadline:
+                        raise RateLimitTimeout(f"нет слота для {endpoint} за {timeout}с")
+                    # Очередь впереди разбудит нас сама, когда заберет свой токен
+                    pause = None if blocked else wait
+                    if deadline is not None:
+                        pause = deadline - now if pause is None else min(pause, deadline - now)
+                    self.cond.wait(pause)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()
+
+        waited = time.monotonic() - started
+        metrics.observe('ratelimit_wait_seconds', waited, family=family or "other", priority=priority)
+        return waited
+
+    def feedback(self, endpoint, status, attempt=0, retry_after=None):
+        """Учесть ответ: подстроить скорость семейства; пауза перед повтором или None"""
+        family, _ = self.route(endpoint)
+        bucket = self.buckets.get(family)
+        with self.cond:
+            if status not in RETRY_STATUSES:
+                if bucket:
+                    bucket.recover()
+                    metrics.set_gauge('ratelimit_rate', bucket.rate, family=family)
+                return None
+            delay = backoff_delay(attempt, retry_after)
+            if status in THROTTLE_STATUSES:
+                for throttled in (bucket, self.global_bucket if family is None else None):
+                    if throttled:
+                        throttled.throttle(time.monotonic(), delay)
+                if bucket:
+                    metrics.set_gauge('ratelimit_rate', bucket.rate, family=family)
+            self.cond.notify_all()
+        return delay
+
+    def stats(self):
+        with self.cond:
+            return {family: {'rate': bucket.rate, 'limit': bucket.max_rate, 'tokens': bucket.tokens}
+                    for family, bucket in self.buckets.items()}
@@ -0,0 +1,121 @@
+import threading
+import time
+from api import calc_trade_profit
+from orders import InFlightRegistry
+from config import (RISK_STOP_LOSS, RISK_TAKE_PROFIT, RISK_TRAILING_START, RISK_TRAILING,
+                    RISK_POLL_INTERVAL, RISK_TRADES_REFRESH)
+
+
+def protective_prices(direction, rate, leverage, stop_loss=RISK_STOP_LOSS, take_profit=RISK_TAKE_PROFIT):
+    """Цены stop-loss/take-profit для порогов PnL в % от суммы сделки с учетом плеча"""
+    sl_move = stop_loss / 100 / leverage
+    tp_move = take_profit / 100 / leverage
+    if direction == 'buy':
+        return rate * (1 - sl_move), rate * (1 + tp_move)
+    return rate * (1 + sl_move), rate * (1 - tp_move)
+
+
+class RiskWatcher:
+    """Быстрый цикл риск-менеджмента: жесткие SL/TP/трейлинг независимо от ИИ"""
+
+    def __init__(self, api, stop_loss=RISK_STOP_LOSS, take_profit=RISK_TAKE_PROFIT,
+                 trailing_start=RISK_TRAILING_START, trailing=RISK_TRAILING,
+                 poll_interval=RISK_POLL_INTERVAL, trades_refresh=RISK_TRADES_REFRESH, registry=None,
+                 clock=time.time):
+        self.api = api
+        # В бэктесте - виртуальные часы, проверки вызываются на каждом баре
+        self.clock = clock
+        # Общий с исполнителем ИИ реестр: одну сделку не закроют дважды
+        self.registry = registry or InFlightRegistry()
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.trailing_start = trailing_start
+        self.trailing = trailing
+        self.poll_interval = poll_interval
+        self.trades_refresh = trades_refresh
+        self.trades = {}
+        self.peaks = {}
+        self.trades_at = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop, name="risk-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def track(self, trade):
+        """Сразу взять под контроль только что открытую сделку"""
+        with self.lock:
+            self.trades[str(trade['id'])] = trade
+
+    def untrack(self, trade_id):
+        with self.lock:
+            self.trades.pop(str(trade_id), None)
+            self.peaks.pop(str(trade_id), None)
+
+    def refresh_trades(self):
+        active_trades = self.api.get_active_trades()
+        if not active_trades or 'trades' not in active_trades:
+            return
+        with self.lock:
+            self.trades = {str(t['id']): t for t in active_trades['trades']}
+            self.peaks = {i: p for i, p in self.peaks.items() if i in self.trades}
+        self.trades_at = self.clock()
+
+    def evaluate(self, trade_id, percent):
+        """Причина закрытия сделки при текущем PnL в %, либо None"""
+        if percent <= -self.stop_loss:
+            return f"стоп-лосс {percent:.1f}%"
+        if percent >= self.take_profit:
+            return f"тейк-профит {percent:.1f}%"
+
+        peak = max(self.peaks.get(trade_id, percent), percent)
+        self.peaks[trade_id] = peak
+        if peak >= self.trailing_start and peak - percent >= self.trailing:
+            return f"трейлинг-стоп {percent:.1f}% (пик {peak:.1f}%)"
+        return None
+
+    def check(self):
+        """Одна проверка всех сделок по свежему снимку котировок"""
+        if self.clock() - self.trades_at >= self.trades_refresh:
+            self.refresh_trades()
+        with self.lock:
+            trades = list(self.trades.items())
+        if not trades:
+            return
+
+        quotes = self.api.get_quotes(max_age=self.poll_interval)
+        for trade_id, trade in trades:
+            price = quotes.rate(trade['instrument'])
+            amount = float(trade['amount'])
+            # Нулевая цена - дыра в котировках, а не обвал: по ней не закрываем
+            if not price or amount <= 0:
+                continue
+            percent = calc_trade_profit(trade, price) / amount * 100
+            reason = self.evaluate(trade_id, percent)
+            if reason is None:
+                continue
+
+            key = f"close:{trade_id}"
+            if not self.registry.claim(key):
+                continue
+            print(f"🛡️  РИСК: закрываем {trade_id} {trade['instrument']} - {reason}")
+            closed = False
+            try:
+                closed = bool(self.api.close_trade(trade_id, idempotency_key=key))
+            finally:
+                self.registry.finish(key, closed)
+            if closed:
+                self.untrack(trade_id)
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                print(f"❌ Ошибка риск-монитора: {e}")
+            self.stop_event.wait(self.poll_interval)
@@ -0,0 +1,76 @@
+import numpy as np
+from config import (MAX_INSTRUMENTS, SCREEN_CANDIDATES, SCREEN_MOMENTUM_WINDOW,
+                    SCREEN_MOMENTUM_WEIGHT, SCREEN_VOLATILITY_WEIGHT, SCREEN_SPREAD_WEIGHT)
+
+
+def _column(rows, key):
+    """Числовая колонка из списка словарей; нечисловые значения - NaN"""
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+    return np.fromiter((number(row.get(key)) for row in rows), dtype=float, count=len(rows))
+
+
+def _zscore(x):
+    # Пропуски (нет истории, нет котировки) считаем «средними», а не лучшими/худшими
+    finite = np.isfinite(x)
+    x = np.where(finite, x, np.median(x[finite]) if finite.any() else 0.0)
+    std = x.std()
+    return (x - x.mean()) / std if std > 0 else np.zeros_like(x)
+
+
+def _spread(rows, rate_key):
+    rate = _column(rows, rate_key)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (_column(rows, 'ask') - _column(rows, 'bid')) / rate * 100
+
+
+def _top(symbols, score, limit, keep):
+    """Символы с лучшим скором плюс обязательные (открытые позиции)"""
+    order = np.argsort(-score, kind='stable')
+    chosen = [symbols[i] for i in order[:limit] if np.isfinite(score[i])]
+    return chosen + [s for s in symbols if s in keep and s not in chosen]
+
+
+def prefilter(instruments, keep=(), limit=SCREEN_CANDIDATES):
+    """Первый этап только по котировкам: открытые торги, узкий спред, сильное дневное движение"""
+    if len(instruments) <= limit:
+        return [inst['symbol'] for inst in instruments]
+    symbols = [inst['symbol'] for inst in instruments]
+    spread = _spread(instruments, 'rate')
+    change = np.abs(_column(instruments, 'profit_day_pl_percent'))
+    score = (SCREEN_MOMENTUM_WEIGHT * _zscore(change)
+             - SCREEN_SPREAD_WEIGHT * _zscore(spread))
+    is_open = np.fromiter((bool(inst.get('is_trading_open', False)) for inst in instruments),
+                          dtype=bool, count=len(instruments))
+    score = np.where(is_open, score, -np.inf)
+    return _top(symbols, score, limit, set(keep))
+
+
+def rank(instruments, keep=(), limit=MAX_INSTRUMENTS):
+    """Второй этап по индикаторам: импульс, волатильность, спред; возвращает top-K + позиции"""
+    if not instruments:
+        return []
+    symbols = [inst['symbol'] for inst in instruments]
+    indicators = [inst.get('indicators') or {} for inst in instruments]
+    momentum = np.abs(np.fromiter(
+        (np.nan if ind.get('returns', {}).get(SCREEN_MOMENTUM_WINDOW) is None
+         else ind['returns'][SCREEN_MOMENTUM_WINDOW] for ind in indicators),
+        dtype=float, count=len(instruments)))
+    volatility = _column(indicators, 'volatility')
+    spread = _spread(instruments, 'current_rate')
+
+    score = (SCREEN_MOMENTUM_WEIGHT * _zscore(momentum)
+             + SCREEN_VOLATILITY_WEIGHT * _zscore(volatility)
+             - SCREEN_SPREAD_WEIGHT * _zscore(spread))
+    is_open = np.fromiter((bool(inst.get('is_trading_open', False)) for inst in instruments),
+                          dtype=bool, count=len(instruments))
+    score = np.where(is_open, score, -np.inf)
+
+    for inst, value in zip(instruments, score):
+        inst['score'] = float(value) if np.isfinite(value) else None
+    chosen = set(_top(symbols, score, limit, set(keep)))
+    # Порядок как в исходном списке, чтобы промпт не «прыгал» между циклами
+    return [inst for inst in instruments if inst['symbol'] in chosen]
@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from candles import bar_time
+from config import STORE_DIR, STORE_RETENTION, STORE_QUOTES_RETENTION, STORE_QUOTES_QUEUE
+
+# Записи фиксированной ширины: файл - это просто массив структур, читается через memmap без разбора
+CANDLE_DTYPE = np.dtype([('t', '<i8'), ('o', '<f8'), ('h', '<f8'), ('l', '<f8'), ('c', '<f8'), ('v', '<f8')])
+# Время котировки - в миллисекундах, снимки идут чаще раза в секунду
+QUOTE_DTYPE = np.dtype([('t', '<i8'), ('rate', '<f8'), ('ask', '<f8'), ('bid', '<f8')])
+
+KINDS = {'candles': CANDLE_DTYPE, 'quotes': QUOTE_DTYPE}
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class StoreBars:
+    """Свечи символа из хранилища в виде списка баров-словарей (для бэктеста), без копирования массива"""
+
+    def __init__(self, records):
+        self.records = records
+        self.times = records['t']
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [dict(zip(CANDLE_DTYPE.names, row)) for row in self.records[index].tolist()]
+        return dict(zip(CANDLE_DTYPE.names, self.records[index].tolist()))
+
+
+class QuoteWriter:
+    """Запись снимков котировок в фоновом потоке: get_quotes не ждет диск.
+
+    Накопившиеся в очереди снимки пишутся одной пачкой; при переполнении
+    новые снимки отбрасываются - котировки в хранилище нужны для анализа, не для торговли.
+    """
+
+    def __init__(self, store, maxsize=STORE_QUOTES_QUEUE):
+        self.store = store
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, snapshot):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="quote-writer", daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait(snapshot)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            snapshots = [s for s in batch if s is not None]
+            try:
+                if snapshots:
+                    self.store.append_quotes(*snapshots)
+            except Exception as e:
+                print(f"❌ Ошибка записи котировок в хранилище: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if len(snapshots) < len(batch):
+                return
+
+    def flush(self):
+        """Дождаться записи всего, что уже в очереди"""
+        if self.thread is not None:
+            self.queue.join()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+class MarketStore:
+    """Постоянное колоночное хранилище свечей и котировок: файл на символ, только дозапись.
+
+    Записи в файле упорядочены по времени, поэтому индекс времени - двоичный поиск
+    прямо по memory-mapped колонке t, без отдельного файла индекса.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.path_locks = {}
+        self.maps = {}
+        self.instruments = None
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, symbol, kind):
+        return os.path.join(self.root, symbol, f"{kind}.bin")
+
+    def _path_lock(self, path):
+        with self.lock:
+            return self.path_locks.setdefault(path, threading.Lock())
+
+    def read(self, symbol, kind):
+        """Все записи символа как memmap; пустой массив, если данных нет"""
+        dtype = KINDS[kind]
+        path = self.path(symbol, kind)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return np.empty(0, dtype=dtype)
+        # Недописанная при сбое хвостовая запись не читается
+        count = size // dtype.itemsize
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        cached = self.maps.get(path)
+        if cached is None or cached[0] != count:
+            # memmap фиксированного размера - после дозаписи открываем заново
+            cached = (count, np.memmap(path, dtype=dtype, mode='r', shape=(count,)))
+            self.maps[path] = cached
+        return cached[1]
+
+    def range(self, records, start=None, end=None, last=None):
+        """Срез [start, end] по времени двоичным поиском, затем не больше last последних записей"""
+        lo = 0 if start is None else int(records['t'].searchsorted(start, side='left'))
+        hi = len(records) if end is None else int(records['t'].searchsorted(end, side='right'))
+        if last is not None:
+            lo = max(lo, hi - last)
+        return records[lo:hi]
+
+    def candles(self, symbol, start=None, end=None, last=None):
+        """Свечи символа (время в секундах) - view на memmap"""
+        return self.range(self.read(symbol, 'candles'), start, end, last)
+
+    def quotes(self, symbol, start=None, end=None, last=None):
+        """Котировки символа (время в мс) - view на memmap"""
+        return self.range(self.read(symbol, 'quotes'), start, end, last)
+
+    def symbols(self):
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def _append(self, symbol, kind, records):
+        """Дописать записи новее последней; запись с тем же временем заменяет последнюю"""
+        path = self.path(symbol, kind)
+        itemsize = records.dtype.itemsize
+        with self._path_lock(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+                # Время последней записи - чтением одной записи с конца, без memmap всего файла
+                count = f.seek(0, os.SEEK_END) // itemsize
+                last = None
+                if count:
+                    f.seek((count - 1) * itemsize)
+                    last = int(np.frombuffer(f.read(itemsize), dtype=records.dtype)['t'][0])
+                    records = records[records['t'] >= last]
+                if not len(records):
+                    return 0
+                # Новая пачка тоже должна идти строго по возрастанию времени
+                keep = np.ones(len(records), dtype=bool)
+                keep[1:] = records['t'][1:] > np.maximum.accumulate(records['t'])[:-1]
+                records = records[keep]
+
+                end = count * itemsize
+                if last is not None and records['t'][0] == last:
+                    # Последний бар еще формировался - переписываем его на месте
+                    end -= itemsize
+                f.seek(end)
+                f.write(records.tobytes())
+                f.truncate()
+            return len(records)
+
+    def append_candles(self, symbol, bars):
+        """Дописать бары из ответа API; возвращает число записанных"""
+        records = np.array([
+            (int(bar_time(bar)), _number(bar.get('o')), _number(bar.get('h')), _number(bar.get('l')),
+             _number(bar.get('c')), _number(bar.get('v')))
+            for bar in bars
+        ], dtype=CANDLE_DTYPE)
+        return self._append(symbol, 'candles', records)
+
+    def append_quotes(self, *snapshots):
+        """Дописать снимки котировок всех инструментов: по одной записи файла на символ за пачку"""
+        rows = {}
+        for snapshot in snapshots:
+            t = int(snapshot.fetched_at * 1000)
+            for inst in snapshot.instruments:
+                rows.setdefault(inst['symbol'], []).append(
+                    (t, _number(inst.get('rate')), _number(inst.get('ask')), _number(inst.get('bid'))))
+        for symbol, records in rows.items():
+            self._append(symbol, 'quotes', np.array(records, dtype=QUOTE_DTYPE))
+        # Справочник инструментов нужен для офлайн-прогонов; переписываем только при изменении состава
+        if snapshots:
+            latest = snapshots[-1].instruments
+            symbols = sorted(inst['symbol'] for inst in latest)
+            if self.instruments != symbols:
+                self.instruments = symbols
+                self.save_instruments(latest)
+
+    def save_instruments(self, instruments):
+        path = os.path.join(self.root, 'instruments.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(instruments, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def load_instruments(self):
+        path = os.path.join(self.root, 'instruments.json')
+        if not os.path.exists(path):
+            return [{'symbol': s, 'is_trading_open': True} for s in self.symbols()]
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def to_columns(self, symbols, length):
+        """Последние length свечей символов в матрицы (символы x бары) для indicators, по правому краю"""
+        tails = {s: self.candles(s, last=length) for s in symbols}
+        present = [s for s in symbols if len(tails[s])]
+        columns = {key: np.full((len(present), length), np.nan) for key in 'ohlcv'}
+        for row, symbol in enumerate(present):
+            tail = tails[symbol]
+            for key in 'ohlcv':
+                columns[key][row, length - len(tail):] = tail[key]
+        return present, columns
+
+    def recording(self, symbols=None, start=None, end=None):
+        """Данные в формате записи бэктеста поверх memmap"""
+        instruments = self.load_instruments()
+        if symbols:
+            instruments = [inst for inst in instruments if inst['symbol'] in symbols]
+        candles = {}
+        for inst in instruments:
+            records = self.candles(inst['symbol'], start, end)
+            if len(records):
+                candles[inst['symbol']] = StoreBars(records)
+        return {'instruments': instruments, 'candles': candles}
+
+    def compact(self, symbol, kind, keep_since):
+        """Переписать файл без записей старше keep_since и без дублей; возвращает (было, стало)"""
+        path = self.path(symbol, kind)
+        scale = 1000 if kind == 'quotes' else 1
+        with self._path_lock(path):
+            records = np.array(self.read(symbol, kind))
+            before = len(records)
+            records = records[records['t'] >= keep_since * scale]
+            # Дубли по времени - оставляем последнюю запись
+            _, last_index = np.unique(records['t'][::-1], return_index=True)
+            records = records[len(records) - 1 - last_index]
+            with open(path + '.tmp', 'wb') as f:
+                f.write(records.tobytes())
+            os.replace(path + '.tmp', path)
+            self.maps.pop(path, None)
+            return before, len(records)
+
+    def compact_all(self, now=None):
+        now = time.time() if now is None else now
+        total_before = total_after = 0
+        for symbol in self.symbols():
+            for kind, retention in (('candles', STORE_RETENTION), ('quotes', STORE_QUOTES_RETENTION)):
+                if os.path.exists(self.path(symbol, kind)):
+                    before, after = self.compact(symbol, kind, now - retention)
+                    total_before += before
+                    total_after += after
+        return total_before, total_after
+
+    def info(self):
+        return {
+            symbol: {kind: len(self.read(symbol, kind)) for kind in KINDS}
+            for symbol in self.symbols()
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хранилище свечей и котировок")
+    parser.add_argument("command", choices=["info", "compact"])
+    parser.add_argument("--root", default=STORE_DIR)
+    args = parser.parse_args()
+
+    store = MarketStore(args.root)
+    if args.command == "info":
+        for symbol, counts in store.info().items():
+            candles = store.candles(symbol)
+            span = (f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(candles['t'][0]))} - "
+                    f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(candles['t'][-1]))}") if len(candles) else "-"
+            print(f"{symbol}: свечей {counts['candles']}, котировок {counts['quotes']}, {span}")
+    else:
+        before, after = store.compact_all()
+        print(f"🗜️  Записей: {before} -> {after}")
@@ -0,0 +1,149 @@
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from backtest import Backtester, RuleBasedAI, load_recording
+from candles import bar_time
+from config import UPDATE_INTERVAL, MAX_LEVERAGE
+
+# Сетка по умолчанию: пороги PnL из prompt.txt, плечо, период цикла
+SWEEP_GRID = {
+    'take_profit': [15, 20, 25],
+    'stop_loss': [5, 8, 10],
+    'leverage': [10, 20, MAX_LEVERAGE],
+    'interval': [UPDATE_INTERVAL, 60],
+    'symbols': [None],
+}
+
+FIELDS = ('t', 'o', 'h', 'l', 'c', 'v')
+
+# Данные воркера: memmap открывается один раз на процесс
+_worker = {}
+
+
+class BarArray:
+    """Свечи символа поверх строк (t, o, h, l, c, v) общего memmap без копирования"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.times = rows[:, 0]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [dict(zip(FIELDS, row)) for row in self.rows[index].tolist()]
+        return dict(zip(FIELDS, self.rows[index].tolist()))
+
+
+def prepare_data(recording_path, data_dir):
+    """Сложить свечи записи в один колоночный файл для memory-mapped чтения"""
+    recording = load_recording(recording_path)
+    os.makedirs(data_dir, exist_ok=True)
+    index, blocks, offset = {}, [], 0
+    for symbol, bars in recording['candles'].items():
+        block = np.array([
+            [bar_time(bar)] + [float(bar[key]) if bar.get(key) is not None else np.nan for key in FIELDS[1:]]
+            for bar in bars
+        ], dtype=np.float64).reshape(-1, len(FIELDS))
+        index[symbol] = [offset, offset + len(block)]
+        blocks.append(block)
+        offset += len(block)
+
+    np.save(os.path.join(data_dir, 'candles.npy'), np.concatenate(blocks) if blocks else np.empty((0, 6)))
+    with open(os.path.join(data_dir, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump({'instruments': recording['instruments'], 'symbols': index}, f, ensure_ascii=False)
+
+
+def _init_worker(data_dir):
+    # Страницы файла разделяются процессами через page cache ОС
+    _worker['candles'] = np.load(os.path.join(data_dir, 'candles.npy'), mmap_mode='r')
+    with open(os.path.join(data_dir, 'index.json'), 'r', encoding='utf-8') as f:
+        _worker['index'] = json.load(f)
+
+
+def _run_one(params):
+    index = _worker['index']
+    candles = {
+        symbol: BarArray(_worker['candles'][start:end])
+        for symbol, (start, end) in index['symbols'].items()
+    }
+    recording = {'instruments': index['instruments'], 'candles': candles}
+
+    leverage = min(params['leverage'], MAX_LEVERAGE)
+    factory = lambda api: RuleBasedAI(api, take_profit=params['take_profit'],
+                                      stop_loss=params['stop_loss'], leverage=leverage)
+    return Backtester(recording, factory, params['interval'], symbols=params['symbols'],
+                      stop_loss=params['stop_loss'], take_profit=params['take_profit']).run()
+
+
+def param_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def grid(spec):
+    keys = list(spec)
+    for values in itertools.product(*(spec[k] for k in keys)):
+        yield dict(zip(keys, values))
+
+
+def load_done(out_path):
+    """Уже посчитанные комбинации - для продолжения после прерывания"""
+    done = {}
+    if os.path.exists(out_path):
+        with open(out_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # оборванная при прерывании строка
+                done[param_key(row['params'])] = row
+    return done
+
+
+def run_sweep(data_dir, out_path, spec=SWEEP_GRID, workers=None):
+    """Прогнать все комбинации параметров на пуле процессов, результаты дописываются построчно"""
+    done = load_done(out_path)
+    pending = [p for p in grid(spec) if param_key(p) not in done]
+    print(f"🧮 Комбинаций: {len(done) + len(pending)}, уже готово: {len(done)}")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=_init_worker, initargs=(data_dir,)) as pool, \
+            open(out_path, 'a', encoding='utf-8') as out:
+        futures = {pool.submit(_run_one, params): params for params in pending}
+        for future in as_completed(futures):
+            params = futures[future]
+            try:
+                row = {'params': params, 'result': future.result()}
+            except Exception as e:
+                print(f"❌ {param_key(params)}: {e}")
+                continue
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            done[param_key(params)] = row
+
+    return sorted(done.values(), key=lambda row: row['result']['pnl'], reverse=True)
+
+
+def print_table(rows, limit=20):
+    print(f"{'PnL':>10} {'DD%':>7} {'Сделок':>7} {'Sharpe':>8}  Параметры")
+    for row in rows[:limit]:
+        r = row['result']
+        print(f"{r['pnl']:>10.2f} {r['max_drawdown']:>7.2f} {r['trades']:>7} {r['sharpe']:>8.2f}  "
+              f"{param_key(row['params'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перебор параметров бэктеста на всех ядрах")
+    parser.add_argument("recording", help="JSON с инструментами и свечами или каталог MarketStore")
+    parser.add_argument("--data-dir", default="sweep_data")
+    parser.add_argument("--out", default="sweep_results.jsonl")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.data_dir, 'candles.npy')):
+        prepare_data(args.recording, args.data_dir)
+    print_table(run_sweep(args.data_dir, args.out, workers=args.workers))
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from config import REQUEST_TIMEOUT, HTTP_POOL_SIZE, HTTP2, RETRY_MAX
+from metrics import metrics
+from ratelimit import RequestScheduler, THROTTLE_STATUSES, parse_retry_after
+
+try:
+    import httpx  # HTTP/2 - опционально, нужен пакет httpx[http2]
+except ImportError:
+    httpx = None
+
+# Тайминги установки соединения пишутся в поток, который выполняет запрос
+_local = threading.local()
+
+
+def _reset_connect_timing():
+    _local.connect = 0.0
+    _local.tls = 0.0
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """Соединение, замеряющее время TCP connect"""
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        sock = super()._new_conn()
+        _local.connect = time.perf_counter() - started
+        return sock
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """Соединение, замеряющее отдельно TCP connect и TLS-рукопожатие"""
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        sock = super()._new_conn()
+        _local.connect = time.perf_counter() - started
+        return sock
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        _local.tls = max(0.0, time.perf_counter() - started - getattr(_local, 'connect', 0.0))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Пул соединений keep-alive с замером connect/TLS"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+class Transport:
+    """Общая HTTP-сессия для всех эндпоинтов: пул, keep-alive, gzip, лимиты, повторы, тайминги"""
+
+    def __init__(self, headers=None, pool_size=HTTP_POOL_SIZE, http2=HTTP2, timeout=REQUEST_TIMEOUT,
+                 scheduler=None, retries=RETRY_MAX):
+        self.timeout = timeout
+        self.scheduler = scheduler or RequestScheduler()
+        self.retries = retries
+        self.timings = deque(maxlen=200)
+        headers = dict(headers or {})
+        headers.setdefault("accept-encoding", "gzip, deflate")
+        headers.setdefault("connection", "keep-alive")
+
+        self.http2 = bool(http2 and httpx is not None)
+        if self.http2:
+            self.client = httpx.Client(
+                http2=True,
+                headers=headers,
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+        else:
+            self.client = requests.Session()
+            self.client.headers.update(headers)
+            adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            self.client.mount("https://", adapter)
+            self.client.mount("http://", adapter)
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """Запрос через планировщик лимитов; при 429/5xx - повтор с паузой"""
+        kwargs.setdefault('timeout', self.timeout)
+        # Метка эндпоинта без id/символов в пути, чтобы не плодить серии метрик
+        endpoint = endpoint or urlsplit(url).path
+        attempt = 0
+        while True:
+            self.scheduler.acquire(endpoint, timeout=kwargs['timeout'])
+            response = self.send(method, url, endpoint, **kwargs)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            delay = self.scheduler.feedback(endpoint, response.status_code, attempt, retry_after)
+            # 5xx на POST мог уже исполниться на бирже - повторяем только явный отказ 429
+            if (delay is None or attempt >= self.retries
+                    or (method != "GET" and response.status_code != 429)):
+                return response
+            attempt += 1
+            metrics.inc('http_retries_total', endpoint=endpoint, status=response.status_code)
+            print(f"🔁 {endpoint}: HTTP {response.status_code}, повтор {attempt}/{self.retries} через {delay:.1f}с")
+            if response.status_code not in THROTTLE_STATUSES:
+                # Троттлинг семейства выдержит планировщик, остальное ждем сами
+                time.sleep(delay)
+            response.close()
+
+    def send(self, method, url, endpoint, **kwargs):
+        """Выполнить запрос и записать разбивку времени connect/TLS/TTFB"""
+        _reset_connect_timing()
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, url, **kwargs)
+        except Exception as e:
+            metrics.observe('http_request_seconds', time.perf_counter() - started,
+                            endpoint=endpoint, status="error")
+            metrics.event('http_error', endpoint=endpoint, error=str(e))
+            raise
+        total = time.perf_counter() - started
+
+        connect = getattr(_local, 'connect', 0.0)
+        tls = getattr(_local, 'tls', 0.0)
+        # elapsed - от отправки запроса до разбора заголовков ответа;
+        # httpx замеряет его до конца чтения тела, поэтому там это верхняя оценка
+        headers_time = response.elapsed.total_seconds()
+        timing = {
+            'method': method,
+            'path': urlsplit(url).path,
+            'status': response.status_code,
+            'connect': connect,
+            'tls': tls,
+            'ttfb': max(0.0, headers_time - connect - tls),
+            'total': total,
+            'reused': connect == 0.0,
+        }
+        _local.last = timing
+        self.timings.append(timing)
+        metrics.observe('http_request_seconds', total, endpoint=endpoint, status=response.status_code)
+        metrics.observe('http_ttfb_seconds', timing['ttfb'], endpoint=endpoint)
+        if not timing['reused']:
+            metrics.observe('http_connect_seconds', connect + tls, endpoint=endpoint)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def last_timing(self):
+        """Тайминги последнего запроса текущего потока"""
+        return getattr(_local, 'last', None)
+
+    def close(self):
+        self.client.close()